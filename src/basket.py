@@ -0,0 +1,218 @@
+"""Хост basket-NN.wbbasket.ru для артикула (card.json, картинки).
+
+Хост зависит от vol = article // 100000. Диапазоны лежат таблицей
+верхних границ (BASKET_RANGES в config.py), поиск - bisect. WB
+регулярно добавляет новые basket, и таблица устаревает: всё, что выше
+неё, угадываем как следующий номер. Если card.json отдал 404, парсер
+зовёт discover - тот перебирает соседние хосты и, найдя нужный,
+поправляет таблицу. Поправки (vol -> NN) сохраняются в BASKET_PATH и
+применяются поверх таблицы при следующем запуске.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import weakref
+from bisect import bisect_left
+from pathlib import Path
+
+from src.config import BASKET_MISS_LIMIT, BASKET_PATH, BASKET_PROBE_RADIUS, BASKET_RANGES
+
+logger = logging.getLogger(__name__)
+
+# сколько фото считать, пока выдача/карточка не сказала точно
+DEFAULT_PHOTOS = 10
+
+# card.json ответил 404 - в отличие от None (429, 5xx, таймаут) это
+# повод поискать другой basket
+NOT_FOUND = object()
+
+
+class BasketResolver:
+    """Таблица vol -> basket с поправками по результатам проб."""
+
+    def __init__(self, path=BASKET_PATH, ranges=BASKET_RANGES, radius=BASKET_PROBE_RADIUS,
+                 miss_limit=BASKET_MISS_LIMIT):
+        self.path = Path(path) if path else None
+        self.radius = radius
+        self.miss_limit = miss_limit
+        self._lock = threading.Lock()
+        self._vol_locks = {}
+        # asyncio.Lock привязан к циклу - держим свои на каждый цикл
+        self._avol_locks = weakref.WeakKeyDictionary()
+        # vol -> артикулы, для которых хост не нашёлся; набралось
+        # miss_limit - vol до конца запуска больше не ищем
+        self._misses = {}
+        self._set_ranges(ranges)
+        self._learned = self._load()
+        for vol in sorted(self._learned):
+            self._apply(vol, self._learned[vol])
+
+    def _set_ranges(self, ranges):
+        ranges = sorted(ranges, key=lambda r: int(r[1]))
+        self._bounds = [int(bound) for bound, _ in ranges]
+        self._hosts = [str(host) for _, host in ranges]
+
+    def _load(self):
+        if self.path is None or not self.path.exists():
+            return {}
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            return {int(vol): str(basket) for vol, basket in data["vols"].items()}
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            logger.warning(f"basket: не прочитали {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        if self.path is None:
+            return
+        # другой процесс мог что-то найти - объединяем с файлом
+        learned = {**self._load(), **self._learned}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            tmp.write_text(
+                json.dumps({"vols": {str(v): learned[v] for v in sorted(learned)}}, indent=1),
+                encoding="utf-8",
+            )
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"basket: не сохранили {self.path}: {e}")
+
+    def basket(self, vol):
+        i = bisect_left(self._bounds, vol)
+        if i < len(self._hosts):
+            return self._hosts[i]
+        # выше таблицы - скорее всего следующий basket
+        return f"{int(self._hosts[-1]) + 1:02d}" if self._hosts else "01"
+
+    def for_article(self, article):
+        return self.basket(article // 100000)
+
+    def _apply(self, vol, basket):
+        # границы монотонны по номеру basket: младшие кончаются до vol,
+        # найденный покрывает vol, старшие начинаются после
+        n = int(basket)
+        ranges = []
+        for bound, host in zip(self._bounds, self._hosts):
+            h = int(host)
+            if h < n:
+                bound = min(bound, vol - 1)
+            elif h == n:
+                bound = max(bound, vol)
+            else:
+                bound = max(bound, vol + 1)
+            ranges.append((bound, host))
+        if basket not in self._hosts:
+            ranges.append((vol, basket))
+        ranges.sort(key=lambda r: int(r[1]))
+
+        # схлопнувшиеся диапазоны: ниже vol оставляем ближний к basket,
+        # выше - тоже ближний (первый)
+        cleaned = []
+        for bound, host in ranges:
+            if cleaned and bound <= cleaned[-1][0]:
+                if int(host) < n:
+                    cleaned[-1] = (bound, host)
+                continue
+            cleaned.append((bound, host))
+        self._set_ranges(cleaned)
+
+    def learn(self, vol, basket):
+        with self._lock:
+            self._learned[vol] = basket
+            self._misses.pop(vol, None)
+            self._apply(vol, basket)
+            self._save()
+        logger.info(f"basket: vol {vol} -> basket-{basket}")
+
+    def candidates(self, failed):
+        """Соседи failed по удалённости: -1, +1, -2, +2..."""
+        g = int(failed)
+        result = []
+        for d in range(1, self.radius + 1):
+            for n in (g - d, g + d):
+                if n >= 1:
+                    result.append(f"{n:02d}")
+        return result
+
+    def _vol_lock(self, vol):
+        with self._lock:
+            return self._vol_locks.setdefault(vol, threading.Lock())
+
+    def _avol_lock(self, vol):
+        locks = self._avol_locks.setdefault(asyncio.get_running_loop(), {})
+        return locks.setdefault(vol, asyncio.Lock())
+
+    def _skip(self, vol, article):
+        # этот артикул уже искали или vol признан ненайденным
+        misses = self._misses.get(vol, ())
+        return article in misses or len(misses) >= self.miss_limit
+
+    def _miss(self, vol, article):
+        with self._lock:
+            self._misses.setdefault(vol, set()).add(article)
+        logger.debug(f"basket: для {article} (vol {vol}) хост не нашли")
+
+    def discover(self, article, failed, status):
+        """card.json на basket failed дал 404 - ищем правильный.
+
+        status(url) -> HTTP код (0 - не ответил), парсеры шлют HEAD, без
+        тела. Зовём только на 404: ошибка или 429 - не повод долбить
+        соседние хосты. Возвращает basket, на
+        котором карточка есть, или None. Пока один поток ищет, остальные
+        с тем же vol ждут и получают его результат.
+        """
+        vol = article // 100000
+        with self._vol_lock(vol):
+            current = self.basket(vol)
+            if current != failed:
+                return current
+            if self._skip(vol, article):
+                return None
+            for basket in self.candidates(failed):
+                if status(card_url(article, basket)) == 200:
+                    self.learn(vol, basket)
+                    return basket
+            self._miss(vol, article)
+        return None
+
+    async def adiscover(self, article, failed, astatus):
+        """discover для async парсеров; astatus(url) - корутина. Пробы по
+        vol так же по одной, файл поправок пишется не в цикле событий."""
+        vol = article // 100000
+        async with self._avol_lock(vol):
+            current = self.basket(vol)
+            if current != failed:
+                return current
+            if self._skip(vol, article):
+                return None
+            for basket in self.candidates(failed):
+                if await astatus(card_url(article, basket)) == 200:
+                    await asyncio.to_thread(self.learn, vol, basket)
+                    return basket
+            self._miss(vol, article)
+        return None
+
+
+baskets = BasketResolver()
+
+
+def basket_base(article, basket=None):
+    vol = article // 100000
+    part = article // 1000
+    basket = basket or baskets.basket(vol)
+    return f"https://basket-{basket}.wbbasket.ru/vol{vol}/part{part}/{article}"
+
+
+def card_url(article, basket=None):
+    return f"{basket_base(article, basket)}/info/ru/card.json"
+
+
+def image_urls(article, count=None):
+    """Ссылки на фото; count - из pics / media.photo_count, если известно."""
+    base = basket_base(article)
+    count = count or DEFAULT_PHOTOS
+    return [f"{base}/images/big/{i}.webp" for i in range(1, count + 1)]
@@ -0,0 +1,124 @@
+"""Пакетный режим: много запросов за один запуск.
+
+    python -m src.main --queries queries.txt --browser
+
+Все запросы идут через один парсер - один браузер (главная грузится один
+раз) или один HTTP клиент. Товар, уже обогащённый в предыдущем запросе,
+заново не запрашивается: ArticleMap копирует его поля. На каждый запрос
+пишется своя выгрузка, в конце - общая, где каждый артикул один раз.
+"""
+
+import dataclasses
+import itertools
+import logging
+import re
+
+from src.models import Product
+from src.sinks import export_all
+
+logger = logging.getLogger(__name__)
+
+_FIELDS = [f.name for f in dataclasses.fields(Product) if f.init]
+_SLUG_RE = re.compile(r"\W+")
+
+
+def _copy(value):
+    # списки и словари - свои у каждого товара, иначе правка одного
+    # (повторное обогащение) видна в выгрузке другого запроса
+    if isinstance(value, list):
+        return list(value)
+    if isinstance(value, dict):
+        return dict(value)
+    return value
+
+
+def read_queries(path):
+    """Запросы из файла: по одному на строку, пустые и # - пропускаем,
+    повторы убираем."""
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            query = line.strip()
+            if query and not query.startswith("#") and query not in queries:
+                queries.append(query)
+    return queries
+
+
+def query_slug(query, maxlen=40):
+    return _SLUG_RE.sub("_", query.lower()).strip("_")[:maxlen] or "query"
+
+
+class ArticleMap:
+    """Артикул -> Product на весь пакет (интерфейс split как у DeltaStore).
+
+    Первый раз товар запоминается и обогащается как обычно (обогащение
+    меняет этот же объект). В следующих запросах поля копируются из
+    запомненного - к этому времени предыдущий запрос уже выгружен.
+    """
+
+    def __init__(self):
+        self.products = {}
+        self.reused = 0
+
+    def split(self, products):
+        stale = set()
+        for p in products:
+            known = self.products.get(p.article)
+            if known is not None and known is not p and (known.description or known.characteristics):
+                for name in _FIELDS:
+                    setattr(p, name, _copy(getattr(known, name)))
+                self.reused += 1
+                continue
+            self.products[p.article] = p
+            stale.add(p.article)
+        return stale
+
+
+def run_batch(parser, queries, formats, out_dir, run_id, filter_func,
+              max_pages=None, enrich=True, parallel=True, track=None):
+    """Все запросы одним парсером. Возвращает {запрос: (всего, фильтр)}
+    и (всего, фильтр) общей выгрузки.
+
+    track - обёртка над потоком товаров (DeltaStore.track, загрузка фото).
+    """
+    articles = ArticleMap()
+    parser.articles = articles
+    merged = {}
+    results = {}
+
+    def remember(group):
+        for _, p in group:
+            merged.setdefault(p.article, p)
+            yield p
+
+    def export(query, products):
+        n = queries.index(query) + 1
+        name = f"{run_id}_{n:02d}_{query_slug(query)}"
+        total, passed, _ = export_all(
+            products, formats,
+            out_dir / f"catalog_full_{name}", out_dir / f"catalog_filtered_{name}", filter_func,
+        )
+        results[query] = (total, passed)
+        logger.info(f"'{query}': {total} товаров, фильтр {passed}")
+
+    stream = parser.iter_parse_batch(queries, max_pages, enrich=enrich, parallel=parallel)
+    for query, group in itertools.groupby(stream, key=lambda item: item[0]):
+        logger.info(f"[{queries.index(query) + 1}/{len(queries)}] '{query}'")
+        products = remember(group)
+        if track is not None:
+            products = track(products)
+        export(query, products)
+
+    # пустой запрос в потоке не встречается - выгрузка у него тоже пустая
+    for query in queries:
+        if query not in results:
+            logger.warning(f"'{query}': ничего не найдено")
+            export(query, [])
+    results = {query: results[query] for query in queries}
+
+    logger.info(f"Повторов между запросами: {articles.reused} (не обогащались заново)")
+    total, passed, _ = export_all(
+        merged.values(), formats,
+        out_dir / f"catalog_full_{run_id}_all", out_dir / f"catalog_filtered_{run_id}_all", filter_func,
+    )
+    return results, (total, passed)
@@ -1,10 +1,33 @@
-"""Простой файловый кэш для разработки."""
+"""Кэш ответов API.
+
+По умолчанию - один файл SQLite (WAL) с LRU вытеснением по размеру,
+можно переключить на старый вариант "файл на ключ" через set_backend.
+"""
 
 import hashlib
-import json
 import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from pathlib import Path
 
+from src.codec import decode, make_codec
+from src.config import (
+    CACHE_BACKEND,
+    CACHE_CODEC,
+    CACHE_COMPRESS_LEVEL,
+    CACHE_MAX_BYTES,
+    CACHE_MEMORY_BYTES,
+    CACHE_MEMORY_ENTRIES,
+    CACHE_TTL,
+    CACHE_ZSTD_DICT_SAMPLES,
+)
+from src.metrics import metrics
+from src.payload import dumps, loads
+
 logger = logging.getLogger(__name__)
 
 CACHE_DIR = Path(".cache")
@@ -18,38 +41,391 @@ def _get_key(prefix, *args):
     return hashlib.md5(data.encode()).hexdigest()
 
 
-def get_cached(key):
-    cache_file = CACHE_DIR / f"{key}.json"
-    if cache_file.exists():
+def cache_ttl(prefix):
+    """TTL по префиксу ключа: search_<запрос> -> CACHE_TTL["search"]."""
+    namespace = prefix.split("_", 1)[0]
+    return CACHE_TTL.get(namespace)
+
+
+@dataclass
+class CacheEntry:
+    """Запись кэша вместе с тем, что нужно для ревалидации."""
+
+    data: object
+    expires: float = None
+    etag: str = None
+    last_modified: str = None
+
+    @property
+    def fresh(self):
+        return self.expires is None or self.expires > time.time()
+
+
+def _expires(ttl):
+    return time.time() + ttl if ttl else None
+
+
+class FileCache:
+    """Файл на ключ в CACHE_DIR - как было раньше, без вытеснения."""
+
+    # в новых файлах данные лежат в конверте с метаданными,
+    # старые файлы - просто JSON без срока годности
+    MARK = "__wb_cache__"
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = Path(directory)
+
+    def entry(self, key):
+        cache_file = self.directory / f"{key}.json"
+        if cache_file.exists():
+            try:
+                raw = loads(cache_file.read_bytes())
+            except Exception:
+                return None
+            if isinstance(raw, dict) and raw.get(self.MARK):
+                return CacheEntry(raw["data"], raw.get("expires"), raw.get("etag"), raw.get("last_modified"))
+            return CacheEntry(raw)
+        return None
+
+    def get(self, key):
+        entry = self.entry(key)
+        if entry and entry.fresh:
+            return entry.data
+        return None
+
+    def set(self, key, data, ttl=None, etag=None, last_modified=None):
+        self._write(key, CacheEntry(data, _expires(ttl), etag, last_modified))
+
+    def touch(self, key, ttl=None):
+        entry = self.entry(key)
+        if entry:
+            entry.expires = _expires(ttl)
+            self._write(key, entry)
+
+    def _write(self, key, entry):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        cache_file = self.directory / f"{key}.json"
+        raw = {
+            self.MARK: 1,
+            "data": entry.data,
+            "expires": entry.expires,
+            "etag": entry.etag,
+            "last_modified": entry.last_modified,
+        }
         try:
-            with open(cache_file, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:
-            pass
-    return None
+            cache_file.write_bytes(dumps(raw))
+        except Exception as e:
+            logger.warning(f"Cache write error: {e}")
 
+    def clear(self):
+        if not self.directory.exists():
+            return 0
+        count = 0
+        for f in self.directory.glob("*.json"):
+            try:
+                f.unlink()
+                count += 1
+            except Exception:
+                pass
+        return count
 
-def set_cached(key, data):
-    CACHE_DIR.mkdir(parents=True, exist_ok=True)
-    cache_file = CACHE_DIR / f"{key}.json"
-    try:
-        with open(cache_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False)
-    except Exception as e:
-        logger.warning(f"Cache write error: {e}")
 
+class SQLiteCache:
+    """Один файл SQLite в режиме WAL.
 
-def clear_cache():
-    if not CACHE_DIR.exists():
-        return 0
-    count = 0
-    for f in CACHE_DIR.glob("*.json"):
+    Соединение своё на каждый поток (и процесс), конкурентную запись
+    разруливает сам SQLite через busy_timeout. У записи есть время
+    создания и последнего чтения; когда суммарный размер больше
+    max_bytes, удаляем самые давно читанные.
+    """
+
+    # проверять размер не на каждую запись
+    EVICT_EVERY = 200
+    # время чтения обновляем не чаще, чтобы чтения не превращались в записи
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, path=CACHE_DIR / "cache.sqlite3", max_bytes=CACHE_MAX_BYTES, codec=None):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        # значения хранятся сжатыми (src/codec.py), несжатые старые читаются как есть
+        self.codec = codec or make_codec(
+            CACHE_CODEC, CACHE_COMPRESS_LEVEL, self.path.parent, CACHE_ZSTD_DICT_SAMPLES,
+        )
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        # после fork соединение родителя использовать нельзя
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY,"
+            " value BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        # колонки для TTL и ревалидации (в старых файлах их нет)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(cache)")}
+        for name, kind in (("expires", "REAL"), ("etag", "TEXT"), ("last_modified", "TEXT")):
+            if name not in columns:
+                try:
+                    conn.execute(f"ALTER TABLE cache ADD COLUMN {name} {kind}")
+                except sqlite3.OperationalError:
+                    pass  # другой процесс успел добавить
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def entry(self, key):
+        try:
+            conn = self._conn()
+            row = conn.execute(
+                "SELECT value, expires, etag, last_modified FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE cache SET accessed = ? WHERE key = ? AND accessed < ?",
+                (now, key, now - self.TOUCH_INTERVAL),
+            )
+            data = loads(decode(row[0], self.path.parent))
+            return CacheEntry(data, row[1], row[2], row[3])
+        except Exception as e:
+            logger.debug(f"Cache read error: {e}")
+            return None
+
+    def get(self, key):
+        entry = self.entry(key)
+        if entry and entry.fresh:
+            return entry.data
+        return None
+
+    def touch(self, key, ttl=None):
+        try:
+            self._conn().execute(
+                "UPDATE cache SET expires = ?, accessed = ? WHERE key = ?",
+                (_expires(ttl), time.time(), key),
+            )
+        except Exception as e:
+            logger.debug(f"Cache touch error: {e}")
+
+    def set(self, key, data, ttl=None, etag=None, last_modified=None):
         try:
-            f.unlink()
-            count += 1
-        except Exception:
-            pass
-    logger.info(f"Очищено {count} файлов кэша")
+            value = self.codec.encode(dumps(data))
+            now = time.time()
+            self._conn().execute(
+                "INSERT OR REPLACE INTO cache"
+                " (key, value, size, created, accessed, expires, etag, last_modified)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now, _expires(ttl), etag, last_modified),
+            )
+        except Exception as e:
+            logger.warning(f"Cache write error: {e}")
+            return
+
+        with self._writes_lock:
+            self._writes += 1
+            due = self._writes % self.EVICT_EVERY == 0
+        if due:
+            # файл делят процессы очереди - занятая база не повод ронять товар
+            try:
+                self.evict()
+            except Exception as e:
+                logger.warning(f"Cache evict error: {e}")
+
+    def evict(self):
+        """Удаляем давно не читанное, пока не влезем в max_bytes."""
+        if not self.max_bytes:
+            return 0
+        conn = self._conn()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+
+        # освобождаем с запасом 10%, чтобы не чистить на каждой проверке
+        excess = total - int(self.max_bytes * 0.9)
+        removed = 0
+        freed = 0
+        while freed < excess:
+            rows = conn.execute(
+                "SELECT key, size FROM cache ORDER BY accessed LIMIT 500"
+            ).fetchall()
+            if not rows:
+                break
+            keys = []
+            for key, size in rows:
+                keys.append((key,))
+                freed += size
+                if freed >= excess:
+                    break
+            conn.executemany("DELETE FROM cache WHERE key = ?", keys)
+            removed += len(keys)
+        logger.info(f"Кэш: вытеснено {removed} записей ({freed // 1024} КБ)")
+        return removed
+
+    def clear(self):
+        if not self.path.exists():
+            return 0
+        conn = self._conn()
+        count = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        conn.execute("DELETE FROM cache")
+        conn.execute("VACUUM")
+        return count
+
+
+class MemoryCache:
+    """LRU в памяти перед любым хранилищем.
+
+    Горячие ключи отдаются без обращения к диску и без разбора JSON.
+    Ограничение по числу записей и, если задано, по примерному размеру
+    в байтах (длина JSON в UTF-8). Один лок на всё - операции короткие.
+    """
+
+    def __init__(self, backend, max_entries=CACHE_MEMORY_ENTRIES, max_bytes=CACHE_MEMORY_BYTES):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _size(self, data):
+        if not self.max_bytes:
+            return 0
+        return len(dumps(data))
+
+    def _put(self, key, entry, size):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[key] = (entry, size)
+            self._bytes += size
+            while self._items and (
+                len(self._items) > self.max_entries
+                or (self.max_bytes and self._bytes > self.max_bytes)
+            ):
+                _, (_, dropped) = self._items.popitem(last=False)
+                self._bytes -= dropped
+
+    def entry(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            self.misses += 1
+        entry = self.backend.entry(key)
+        if entry is not None:
+            self._put(key, entry, self._size(entry.data))
+        return entry
+
+    def get(self, key):
+        entry = self.entry(key)
+        if entry and entry.fresh:
+            return entry.data
+        return None
+
+    def set(self, key, data, ttl=None, etag=None, last_modified=None):
+        self.backend.set(key, data, ttl=ttl, etag=etag, last_modified=last_modified)
+        self._put(key, CacheEntry(data, _expires(ttl), etag, last_modified), self._size(data))
+
+    def touch(self, key, ttl=None):
+        self.backend.touch(key, ttl)
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                item[0].expires = _expires(ttl)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+        return self.backend.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+
+BACKENDS = {
+    "sqlite": SQLiteCache,
+    "file": FileCache,
+}
+
+_backend = None
+
+
+def set_backend(backend, memory_entries=CACHE_MEMORY_ENTRIES):
+    """Меняем хранилище кэша: имя из BACKENDS или готовый объект
+    с методами get/entry/set/touch/clear. Если memory_entries > 0,
+    спереди ставится MemoryCache."""
+    global _backend
+    if isinstance(backend, str):
+        backend = BACKENDS[backend]()
+    if memory_entries:
+        backend = MemoryCache(backend, max_entries=memory_entries)
+    _backend = backend
+    return _backend
+
+
+def cache_stats():
+    """Попадания в памяти, если MemoryCache включён."""
+    backend = get_backend()
+    return backend.stats() if isinstance(backend, MemoryCache) else None
+
+
+def get_backend():
+    if _backend is None:
+        set_backend(CACHE_BACKEND)
+    return _backend
+
+
+def get_cached(key):
+    """Данные из кэша, если запись есть и не протухла."""
+    data = get_backend().get(key)
+    metrics.inc("wb_cache_total", result="miss" if data is None else "hit")
+    return data
+
+
+def get_cache_entry(key):
+    """Запись даже протухшая - с etag/last_modified для ревалидации."""
+    entry = get_backend().entry(key)
+    metrics.inc("wb_cache_total", result="miss" if entry is None else "hit" if entry.fresh else "stale")
+    return entry
+
+
+def set_cached(key, data, ttl=None, etag=None, last_modified=None):
+    get_backend().set(key, data, ttl=ttl, etag=etag, last_modified=last_modified)
+
+
+def touch_cached(key, ttl=None):
+    """Продлеваем запись (сервер ответил 304)."""
+    get_backend().touch(key, ttl)
+
+
+def clear_cache():
+    count = get_backend().clear()
+    logger.info(f"Очищено {count} записей кэша")
     return count
 
 get_cache_key = _get_key
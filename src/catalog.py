@@ -0,0 +1,189 @@
+"""Колоночный каталог для быстрой перефильтрации.
+
+Числовые поля товаров лежат в массивах NumPy, бренд/продавец/страна -
+словарём (коды + список значений). Фильтры, сортировка и топ-N
+считаются векторно и возвращают индексы, по которым take() отдаёт
+сами Product - их можно сразу передавать в выгрузки.
+
+Запросы по характеристикам (src/query.py) идут через инвертированный
+индекс, который строится при первом where() и дальше переиспользуется.
+"""
+
+import json
+import logging
+
+import numpy as np
+
+from src.models import Product
+from src.query import CharIndex, Query
+
+logger = logging.getLogger(__name__)
+
+NUMERIC = {
+    "article": np.int64,
+    "price": np.int64,
+    "rating": np.float64,
+    "stock": np.int64,
+    "feedbacks_count": np.int64,
+}
+CATEGORICAL = ("brand", "seller_name", "country")
+
+
+def _encode(values):
+    # словарное кодирование: одинаковые строки -> один код
+    index = {}
+    codes = np.fromiter((index.setdefault(v, len(index)) for v in values), dtype=np.int32)
+    return codes, list(index)
+
+
+class Catalog:
+    """Каталог товаров в колонках."""
+
+    def __init__(self, products):
+        self.products = list(products)
+        n = len(self.products)
+
+        for name, dtype in NUMERIC.items():
+            column = np.fromiter((getattr(p, name) or 0 for p in self.products), dtype=dtype, count=n)
+            setattr(self, name, column)
+        self.price_rub = self.price / 100
+
+        self.codes = {}
+        self.categories = {}
+        for name in CATEGORICAL:
+            codes, categories = _encode(getattr(p, name) or "" for p in self.products)
+            self.codes[name] = codes
+            self.categories[name] = categories
+        self._char_index = None
+
+    def __len__(self):
+        return len(self.products)
+
+    @classmethod
+    def from_jsonl(cls, path):
+        """Каталог из выгрузки JSONL (sinks.JsonlSink)."""
+        products = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    products.append(_product_from_row(json.loads(line)))
+        logger.info(f"Загружено {len(products)} товаров из {path}")
+        return cls(products)
+
+    def column(self, name):
+        """Числовая колонка или коды категориальной."""
+        if name in self.codes:
+            return self.codes[name]
+        return getattr(self, name)
+
+    def category_mask(self, name, predicate):
+        """Маска по категориальной колонке: predicate считается один раз
+        на уникальное значение, а не на каждый товар."""
+        matched = [code for code, value in enumerate(self.categories[name]) if predicate(value)]
+        return np.isin(self.codes[name], matched)
+
+    def mask(self, min_rating=None, max_price=None, country=None):
+        """То же что Product.matches_filter, но сразу для всех товаров.
+
+        None - условие не проверяется. Пустая страна, как и в
+        matches_filter, не проходит, если страна задана.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if min_rating is not None:
+            mask &= self.rating >= min_rating
+        if max_price is not None:
+            mask &= self.price_rub <= max_price
+        if country is not None:
+            needle = country.lower()
+            mask &= self.category_mask("country", lambda v: bool(v) and needle in v.lower())
+        return mask
+
+    def filter(self, min_rating=None, max_price=None, country=None):
+        """Индексы товаров, прошедших фильтр."""
+        return np.flatnonzero(self.mask(min_rating, max_price, country))
+
+    @property
+    def char_index(self):
+        """Индекс характеристик - один на каталог."""
+        if self._char_index is None:
+            self._char_index = CharIndex(self.products)
+        return self._char_index
+
+    def where(self, query, indices=None):
+        """Индексы товаров под запрос по характеристикам (строка или Query),
+        если indices заданы - только среди них."""
+        if isinstance(query, str):
+            query = Query(query)
+        found = query.indices(self.char_index)
+        if indices is None:
+            return found
+        return np.intersect1d(indices, found, assume_unique=True)
+
+    def sort(self, by, indices=None, descending=False):
+        """Индексы, отсортированные по колонке (стабильно)."""
+        if indices is None:
+            indices = np.arange(len(self))
+        values = self.column(by)[indices]
+        if by in self.codes:
+            # коды идут в порядке появления - сортируем по самим строкам
+            ranks = np.argsort(np.argsort(self.categories[by], kind="stable"), kind="stable")
+            values = ranks[values]
+        order = np.argsort(-values if descending else values, kind="stable")
+        return indices[order]
+
+    def top(self, n, by, indices=None, descending=True):
+        """Первые n по колонке; argpartition вместо полной сортировки."""
+        if indices is None:
+            indices = np.arange(len(self))
+        if n >= len(indices):
+            return self.sort(by, indices, descending)
+        values = self.column(by)[indices]
+        key = -values if descending else values
+        part = np.argpartition(key, n - 1)[:n]
+        return self.sort(by, indices[part], descending)
+
+    def take(self, indices):
+        """Product по индексам - для выгрузок."""
+        products = self.products
+        return (products[i] for i in indices)
+
+
+def _split_list(row, name):
+    # списки в JSONL как есть; в старых выгрузках - строкой через ", "
+    value = row.get(name)
+    if isinstance(value, list):
+        return value
+    joined = row.get(f"{name}_str") or ""
+    # пути к фото стоят по месту ссылки, пустые не выкидываем
+    if name == "image_paths":
+        return joined.split(", ") if joined else []
+    return [s for s in joined.split(", ") if s]
+
+
+def _product_from_row(row):
+    # обратно из колонок COLUMNS; описание уже без HTML
+    characteristics = row.get("characteristics")
+    if not isinstance(characteristics, dict):
+        characteristics = {}
+        for line in (row.get("characteristics_str") or "").split("\n"):
+            name, sep, value = line.partition(": ")
+            if sep:
+                characteristics[name] = value
+    return Product(
+        url=row.get("url", ""),
+        article=int(row.get("article") or 0),
+        name=row.get("name", ""),
+        price=round(float(row.get("price_rub") or 0) * 100),
+        description=row.get("description_clean", ""),
+        images=_split_list(row, "images"),
+        image_paths=_split_list(row, "image_paths"),
+        characteristics=characteristics,
+        seller_name=row.get("seller_name", ""),
+        seller_url=row.get("seller_url", ""),
+        sizes=_split_list(row, "sizes"),
+        stock=int(row.get("stock") or 0),
+        rating=float(row.get("rating") or 0),
+        feedbacks_count=int(row.get("feedbacks_count") or 0),
+        brand=row.get("brand", ""),
+        country=row.get("country", ""),
+    )
@@ -0,0 +1,224 @@
+"""Журнал запуска: страницы поиска и обогащённые товары по мере готовности.
+
+Журнал - JSONL в <output>/runs/<run-id>.jsonl, по записи на строку:
+
+    {"type": "meta", "query": ..., "pages": ..., "enrich": ...}
+    {"type": "page", "page": 3, "products": [...]}     - страница поиска
+    {"type": "search_done"}                            - поиск закончился
+    {"type": "product", "product": {...}}              - товар ушёл в выгрузку
+
+Строки дописываются сразу и раз в CHECKPOINT_FSYNC сек сбрасываются на
+диск, так что после Ctrl+C, падения браузера или исключения теряется
+только то, что было в работе. --resume <run-id> отдаёт записанные
+страницы без запросов, продолжает поиск со следующей, а обогащённые
+товары восстанавливает без detail/card. Оборванная последняя строка
+(упали посреди записи) пропускается.
+"""
+
+import dataclasses
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from src.config import CHECKPOINT_FSYNC
+from src.models import Product
+
+logger = logging.getLogger(__name__)
+
+_FIELDS = [f.name for f in dataclasses.fields(Product) if f.init]
+
+
+def product_to_dict(product):
+    return {name: getattr(product, name) for name in _FIELDS}
+
+
+def product_from_dict(data):
+    return Product(**{name: data[name] for name in _FIELDS if name in data})
+
+
+def journal_path(out_dir, run_id):
+    return Path(out_dir) / "runs" / f"{run_id}.jsonl"
+
+
+class RunJournal:
+    """Журнал одного запуска; открывается на дозапись, если уже есть."""
+
+    def __init__(self, path, meta=None):
+        self.path = Path(path)
+        self.meta = {}
+        self.pages = {}
+        self.last_page = 0
+        self.search_done = False
+        self.enriched = {}
+        self._restored = set()
+        self._lock = threading.Lock()
+        self._synced = time.monotonic()
+
+        if self.path.exists():
+            self._load()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        if not self.meta and meta:
+            self.meta = dict(meta)
+            self._write({"type": "meta", **self.meta})
+
+    @classmethod
+    def resume(cls, out_dir, run_id):
+        path = journal_path(out_dir, run_id)
+        if not path.exists():
+            raise FileNotFoundError(f"Нет журнала запуска {run_id}: {path}")
+        journal = cls(path)
+        logger.info(f"Журнал {run_id}: страниц {len(journal.pages)}, "
+                    f"товаров {len(journal.enriched)}"
+                    f"{', поиск закончен' if journal.search_done else ''}")
+        return journal
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Журнал: пропущена битая строка в {self.path.name}")
+                    continue
+                kind = record.pop("type", None)
+                if kind == "meta":
+                    self.meta = record
+                elif kind == "page":
+                    self.pages[record["page"]] = record["products"]
+                    self.last_page = max(self.last_page, record["page"])
+                elif kind == "search_done":
+                    self.search_done = True
+                elif kind == "product":
+                    data = record["product"]
+                    self.enriched[data["article"]] = data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(line)
+            self._file.flush()
+            now = time.monotonic()
+            if now - self._synced >= CHECKPOINT_FSYNC:
+                os.fsync(self._file.fileno())
+                self._synced = now
+
+    @property
+    def next_page(self):
+        """С какой страницы продолжать поиск."""
+        return self.last_page + 1
+
+    def replay_pages(self):
+        """Записанные страницы поиска по порядку, как их отдал бы iter_search."""
+        while self.pages:
+            page = min(self.pages)
+            products = [product_from_dict(d) for d in self.pages.pop(page)]
+            logger.info(f"Страница {page}: {len(products)} из журнала")
+            yield products
+
+    def page_done(self, page, products):
+        self.last_page = max(self.last_page, page)
+        self._write({"type": "page", "page": page, "products": [product_to_dict(p) for p in products]})
+
+    def finish_search(self):
+        if not self.search_done:
+            self.search_done = True
+            self._write({"type": "search_done"})
+
+    def split(self, products):
+        """Как DeltaStore.split: уже обогащённые в этом запуске
+        восстанавливаем, возвращаем set артикулов, которые обогащать."""
+        stale = set()
+        for p in products:
+            data = self.enriched.pop(p.article, None)
+            if data is None:
+                stale.add(p.article)
+                continue
+            restored = product_from_dict(data)
+            for name in _FIELDS:
+                setattr(p, name, getattr(restored, name))
+            self._restored.add(p.article)
+        return stale
+
+    def save(self, product):
+        if product.article in self._restored:
+            self._restored.discard(product.article)
+            return
+        self._write({"type": "product", "product": product_to_dict(product)})
+
+    def track(self, products):
+        """Пропускаем поток товаров через save - для main."""
+        for p in products:
+            self.save(p)
+            yield p
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def remove(self):
+        """Запуск закончился - журнал больше не нужен."""
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+
+def first_page(journal):
+    return journal.next_page if journal is not None else 1
+
+
+def iter_journaled(journal, pages, max_pages):
+    """Страницы поиска через журнал (для iter_search парсеров).
+
+    pages - генератор (номер, товары) с first_page(journal), пустой
+    список товаров - выдача кончилась. Записанные раньше страницы
+    отдаются первыми без запросов, новые записываются. Поиск считается
+    законченным на пустой или последней странице - если страница не
+    загрузилась, --resume продолжит поиск после последней записанной.
+    """
+    if journal is not None:
+        yield from journal.replay_pages()
+        if journal.search_done:
+            pages.close()
+            return
+    for page, products in pages:
+        _record(journal, page, products, max_pages)
+        if products:
+            yield products
+
+
+async def aiter_journaled(journal, pages, max_pages):
+    """iter_journaled для async генератора страниц."""
+    if journal is not None:
+        for products in journal.replay_pages():
+            yield products
+        if journal.search_done:
+            await pages.aclose()
+            return
+    async for page, products in pages:
+        _record(journal, page, products, max_pages)
+        if products:
+            yield products
+
+
+def _record(journal, page, products, max_pages):
+    if journal is None:
+        return
+    if products:
+        journal.page_done(page, products)
+    if not products or page >= max_pages:
+        journal.finish_search()
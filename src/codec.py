@@ -0,0 +1,145 @@
+"""Сжатие значений кэша.
+
+Сжатые данные начинаются с нулевого байта и метки кодека - JSON так
+начинаться не может, поэтому старые несжатые записи читаются как есть.
+"""
+
+import logging
+import struct
+import threading
+import zlib
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_ZLIB = b"\x00Z"
+_ZSTD = b"\x00S"
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+class PlainCodec:
+    name = "none"
+
+    def encode(self, raw):
+        return raw
+
+
+class ZlibCodec:
+    name = "zlib"
+
+    def __init__(self, level=None):
+        self.level = 6 if level is None else level
+
+    def encode(self, raw):
+        return _ZLIB + zlib.compress(raw, self.level)
+
+
+class ZstdCodec:
+    """zstd со словарём.
+
+    Карточки и страницы поиска очень похожи между собой, поэтому
+    словарь, обученный на первых dict_samples записях, заметно
+    улучшает сжатие. Словари лежат рядом с кэшем и не удаляются -
+    в заголовке записи id словаря, которым она сжата (0 - без словаря).
+    """
+
+    name = "zstd"
+    DICT_SIZE = 112 * 1024
+
+    def __init__(self, level=None, dict_dir=Path(".cache"), dict_samples=500):
+        self.zstd = _zstd()
+        self.level = 3 if level is None else level
+        self.dict_dir = Path(dict_dir)
+        self.dict_samples = dict_samples
+        self._dict = None
+        self._samples = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        current = self.dict_dir / "zstd-current.dict"
+        if current.exists():
+            self._dict = self.zstd.ZstdCompressionDict(current.read_bytes())
+
+    def _train(self):
+        try:
+            d = self.zstd.train_dictionary(self.DICT_SIZE, self._samples)
+        except Exception as e:
+            logger.debug(f"zstd dict training failed: {e}")
+            self.dict_samples = 0
+            return
+        self.dict_dir.mkdir(parents=True, exist_ok=True)
+        data = d.as_bytes()
+        (self.dict_dir / f"zstd-{d.dict_id()}.dict").write_bytes(data)
+        (self.dict_dir / "zstd-current.dict").write_bytes(data)
+        self._dict = d
+        self._samples = []
+        logger.info(f"Кэш: обучен zstd словарь #{d.dict_id()}")
+
+    def _compressor(self):
+        # компрессоры не потокобезопасны - свой на поток и на словарь
+        d = self._dict
+        cached = getattr(self._local, "compressor", None)
+        if cached is None or cached[0] is not d:
+            c = self.zstd.ZstdCompressor(level=self.level, dict_data=d)
+            cached = self._local.compressor = (d, c)
+        return cached[1]
+
+    def encode(self, raw):
+        if self._dict is None and self.dict_samples:
+            with self._lock:
+                if self._dict is None:
+                    self._samples.append(raw)
+                    if len(self._samples) >= self.dict_samples:
+                        self._train()
+        d = self._dict
+        dict_id = d.dict_id() if d is not None else 0
+        return _ZSTD + struct.pack(">I", dict_id) + self._compressor().compress(raw)
+
+
+_dicts = {}
+
+
+def _zstd_decode(payload, dict_dir):
+    zstd = _zstd()
+    if zstd is None:
+        raise ValueError("запись сжата zstd, а zstandard не установлен")
+    (dict_id,) = struct.unpack(">I", payload[:4])
+    d = None
+    if dict_id:
+        d = _dicts.get(dict_id)
+        if d is None:
+            d = zstd.ZstdCompressionDict((Path(dict_dir) / f"zstd-{dict_id}.dict").read_bytes())
+            _dicts[dict_id] = d
+    return zstd.ZstdDecompressor(dict_data=d).decompress(payload[4:])
+
+
+def decode(value, dict_dir=Path(".cache")):
+    """Байты из кэша -> исходный JSON (любой кодек или без сжатия)."""
+    value = bytes(value) if not isinstance(value, bytes) else value
+    head = value[:2]
+    if head == _ZLIB:
+        return zlib.decompress(value[2:])
+    if head == _ZSTD:
+        return _zstd_decode(value[2:], dict_dir)
+    return value
+
+
+def make_codec(name="auto", level=None, dict_dir=Path(".cache"), dict_samples=500):
+    """auto - zstd если установлен zstandard, иначе zlib."""
+    if name == "auto":
+        name = "zstd" if _zstd() else "zlib"
+    if name == "zstd":
+        if _zstd() is None:
+            logger.warning("zstandard не установлен, кэш сжимается zlib")
+            return ZlibCodec(level)
+        return ZstdCodec(level, dict_dir=dict_dir, dict_samples=dict_samples)
+    if name == "zlib":
+        return ZlibCodec(level)
+    return PlainCodec()
@@ -4,6 +4,8 @@ import random
 
 SEARCH_URL = "https://search.wb.ru/exactmatch/ru/common/v7/search"
 DETAIL_API_URL = "https://card.wb.ru/cards/v2/detail"
+# сколько nm в одном запросе к DETAIL_API_URL
+DETAIL_BATCH_SIZE = 100
 SELLER_URL = "https://www.wildberries.ru/seller/{seller_id}"
 PRODUCT_URL = "https://www.wildberries.ru/catalog/{article}/detail.aspx"
 
@@ -34,11 +36,130 @@ REQUEST_TIMEOUT = 30
 RETRY_COUNT = 5
 RETRY_DELAY = 3.0
 MAX_PAGES = 50
+# сколько страниц поиска грузить одновременно (1 - по одной)
+SEARCH_WINDOW = 1
 
-DELAY_BETWEEN_PAGES = 2.0
-DELAY_BETWEEN_PRODUCTS = 1.5
+# пауза на хост при 429 без Retry-After
 DELAY_ON_ERROR = 5.0
 
+# лимитер запросов (на каждый хост), req/s
+RATE_INITIAL = 1.0
+RATE_MIN = 0.2
+RATE_MAX = 30.0
+RATE_BURST = 5
+# AIMD: +RATE_INCREASE если 429 мало, *RATE_DECREASE если много
+RATE_INCREASE = 0.5
+RATE_DECREASE = 0.5
+RATE_WINDOW = 20
+RATE_TARGET_429 = 0.02
+
+# сколько товаров максимум в работе между поиском и экспортом
+PIPELINE_BUFFER = 200
+
+# сколько запросов одновременно в async режиме
+ASYNC_CONCURRENCY = 100
+# страниц браузера в пуле для --browser-pool
+BROWSER_POOL_SIZE = 4
+
+# что браузеру не грузить - нам нужен только JSON поиска
+BLOCK_RESOURCES = True
+BLOCK_RESOURCE_TYPES = ("image", "media", "font")
+BLOCK_DOMAINS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "mc.yandex.ru",
+    "an.yandex.ru",
+    "top-fwz1.mail.ru",
+    "connect.facebook.net",
+    "vk.com",
+)
+# гибрид: не пересоздавать сессию в браузере чаще чем раз в N сек
+HYBRID_REBOOTSTRAP_LIMIT = 60
+
+# сколько ждать ответ search.wb.ru после перехода на страницу, сек
+SEARCH_API_TIMEOUT = 20
+
+# basket-NN.wbbasket.ru по vol = article // 100000: (последний vol, NN);
+# что выше таблицы и поправки после 404 - в BASKET_PATH (src/basket.py)
+BASKET_RANGES = [
+    (143, "01"), (287, "02"), (431, "03"), (719, "04"), (1007, "05"),
+    (1061, "06"), (1115, "07"), (1169, "08"), (1313, "09"), (1601, "10"),
+    (1655, "11"), (1919, "12"), (2045, "13"), (2189, "14"), (2405, "15"),
+    (2621, "16"), (2837, "17"),
+]
+BASKET_PATH = ".cache/baskets.json"
+# на 404 карточки пробуем до стольких соседних basket в каждую сторону
+BASKET_PROBE_RADIUS = 6
+# vol считаем ненайденным, когда хост не нашёлся у стольких разных
+# артикулов (одна удалённая карточка - ещё не повод)
+BASKET_MISS_LIMIT = 3
+
+# кэш: "sqlite" - один файл .cache/cache.sqlite3, "file" - файл на ключ
+CACHE_BACKEND = "sqlite"
+# выше этого размера sqlite кэш вытесняет давно не читанное
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+# сжатие значений в sqlite кэше: "auto" (zstd если есть zstandard, иначе zlib),
+# "zstd", "zlib", "none"; уровень None - по умолчанию кодека
+CACHE_CODEC = "auto"
+CACHE_COMPRESS_LEVEL = None
+# на скольких первых записях учить zstd словарь (0 - без словаря)
+CACHE_ZSTD_DICT_SAMPLES = 500
+
+# LRU в памяти перед кэшем на диске: записей и (если не 0) байт
+CACHE_MEMORY_ENTRIES = 20000
+CACHE_MEMORY_BYTES = 0
+# сколько живут записи по префиксу ключа, сек (None - вечно)
+# цены и остатки (search, detail) меняются быстро, карточка - редко
+CACHE_TTL = {
+    "search": 30 * 60,
+    "detail": 30 * 60,
+    "card": 7 * 24 * 3600,
+}
+# в кэш (и парсеру) - только поля, которые парсер читает (src/payload.py)
+CACHE_PRUNE = True
+
+# разбор JSON: "auto" (orjson если установлен, иначе json), "orjson", "json"
+JSON_BACKEND = "auto"
+
+# --delta: отпечатки и обогащение прошлых запусков; старше DELTA_MAX_AGE сек
+# обогащаем заново даже без изменений (описание в карточке тоже меняется)
+DELTA_PATH = ".cache/delta.sqlite3"
+DELTA_MAX_AGE = 7 * 24 * 3600
+
+# журнал запуска для --resume (<output>/runs/<run-id>.jsonl): fsync не чаще
+# раз в CHECKPOINT_FSYNC сек; после успешного запуска журнал удаляется
+CHECKPOINT = True
+CHECKPOINT_FSYNC = 5.0
+CHECKPOINT_KEEP = False
+
+# --images: потоков загрузки, соединений на один хост basket, сколько
+# товаров одновременно ждут своих фото между обогащением и выгрузкой
+IMAGES_WORKERS = 16
+IMAGES_PER_HOST = 4
+IMAGES_BUFFER = 50
+
+# очередь обогащения (--queue / src.worker): аренда пачки, сек; попыток на
+# товар; сколько товаров воркер берёт за раз; пауза на пустой очереди, сек
+QUEUE_VISIBILITY = 600
+QUEUE_MAX_ATTEMPTS = 3
+QUEUE_LEASE_BATCH = 20
+QUEUE_POLL = 2.0
+# координатор перестаёт ждать, если за столько сек ни один товар не
+# обогатился (воркеров нет); недоделанное выгружается как из поиска
+QUEUE_STALL_TIMEOUT = 1800
+
+# метрики (src/metrics.py): границы корзин гистограмм времени, сек;
+# как часто переписывать файл --metrics, сек; адрес для --metrics-port
+# (0.0.0.0 - если Prometheus скрапит из другого контейнера)
+METRICS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_INTERVAL = 15
+METRICS_HOST = "127.0.0.1"
+
+# выгрузка: форматы по умолчанию и размер группы строк в parquet
+EXPORT_FORMATS = ("xlsx",)
+PARQUET_BATCH_ROWS = 10000
+
 DEFAULT_FILTER = {
     "min_rating": 4.5,
     "max_price": 10000,
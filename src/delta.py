@@ -0,0 +1,186 @@
+"""Инкрементальный обход: обогащаем только новые и изменившиеся товары.
+
+Для каждого артикула храним отпечаток полей из поисковой выдачи
+(цена, остатки, рейтинг, отзывы...) и то, что дало обогащение. Если
+в следующем запуске отпечаток тот же и запись не старше DELTA_MAX_AGE,
+detail/card не запрашиваются - поля берутся из хранилища.
+
+    delta = DeltaStore()
+    stale = delta.split(page_products)   # остальные уже восстановлены
+    ...обогащаем товары из stale...
+    for p in delta.track(products): ...  # запоминаем обогащённое
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from src.config import DELTA_MAX_AGE, DELTA_PATH
+from src.models import intern_str
+
+logger = logging.getLogger(__name__)
+
+# что видно уже в поиске - по этому решаем, менялся ли товар
+SNAPSHOT_FIELDS = ("name", "brand", "price", "stock", "rating", "feedbacks_count", "seller_name", "sizes")
+# что заполняет enrich (card, а в браузере ещё и detail)
+ENRICHED_FIELDS = (
+    "description", "characteristics", "country", "seller_name", "seller_url",
+    "sizes", "stock", "price", "rating", "feedbacks_count", "images",
+)
+_INTERNED = ("country", "seller_name")
+
+
+def fingerprint(product):
+    """Отпечаток поисковых полей - 64 бита."""
+    raw = json.dumps([getattr(product, f) for f in SNAPSHOT_FIELDS], ensure_ascii=False)
+    return int.from_bytes(hashlib.blake2b(raw.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+
+class DeltaStore:
+    """Отпечатки и обогащение прошлых запусков в одном файле SQLite.
+
+    Отпечатки читаются в память при открытии (артикул -> (отпечаток,
+    время)), обогащение - пачкой на страницу. Запись буферизуется и
+    уходит транзакцией каждые FLUSH_EVERY товаров и в close().
+    """
+
+    FLUSH_EVERY = 200
+
+    def __init__(self, path=DELTA_PATH, max_age=DELTA_MAX_AGE):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS delta ("
+            " article INTEGER PRIMARY KEY,"
+            " fingerprint INTEGER NOT NULL,"
+            " updated REAL NOT NULL,"
+            " enriched TEXT NOT NULL)"
+        )
+        self._known = {
+            article: (fp, updated)
+            for article, fp, updated in self._conn.execute("SELECT article, fingerprint, updated FROM delta")
+        }
+        # отпечатки из поиска этого запуска - ждут обогащения
+        self._pending = {}
+        self._buffer = []
+        self.reused = 0
+        self.enriched = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def split(self, products):
+        """Товары страницы до обогащения: неизменившиеся восстанавливаем
+        из хранилища, возвращаем set артикулов, которые надо обогатить."""
+        now = time.time()
+        stale = set()
+        # (артикул, товар): один артикул бывает на странице дважды
+        fresh = []
+        with self._lock:
+            for p in products:
+                fp = fingerprint(p)
+                known = self._known.get(p.article)
+                if known and known[0] == fp and (not self.max_age or now - known[1] < self.max_age):
+                    fresh.append((p.article, p))
+                else:
+                    self._pending[p.article] = fp
+                    stale.add(p.article)
+            stored = self._load(list({article for article, _ in fresh})) if fresh else {}
+
+        for article, p in fresh:
+            data = stored.get(article)
+            if data is None:
+                stale.add(article)
+                with self._lock:
+                    self._pending[article] = fingerprint(p)
+                continue
+            _restore(p, data)
+            self.reused += 1
+        return stale
+
+    def _load(self, articles):
+        marks = ",".join("?" * len(articles))
+        rows = self._conn.execute(
+            f"SELECT article, enriched FROM delta WHERE article IN ({marks})", articles
+        ).fetchall()
+        return {article: json.loads(enriched) for article, enriched in rows}
+
+    def save(self, product):
+        """Запоминаем обогащённый товар (если он ждал обогащения)."""
+        with self._lock:
+            fp = self._pending.pop(product.article, None)
+            if fp is None:
+                return
+            # пустая карточка - не запоминаем, в следующий раз попробуем снова
+            if not (product.description or product.characteristics):
+                return
+            data = {f: getattr(product, f) for f in ENRICHED_FIELDS}
+            now = time.time()
+            self._buffer.append((product.article, fp, now, json.dumps(data, ensure_ascii=False)))
+            self._known[product.article] = (fp, now)
+            self.enriched += 1
+            if len(self._buffer) >= self.FLUSH_EVERY:
+                self._flush()
+
+    def track(self, products):
+        """Пропускаем поток товаров через save - для main."""
+        for p in products:
+            self.save(p)
+            yield p
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO delta (article, fingerprint, updated, enriched) VALUES (?, ?, ?, ?)",
+                self._buffer,
+            )
+        self._buffer = []
+
+    def close(self):
+        with self._lock:
+            if self._conn is None:
+                return
+            self._flush()
+            self._conn.close()
+            self._conn = None
+        logger.info(f"Дельта: повторно использовано {self.reused}, обогащено {self.enriched}")
+
+
+def _restore(product, data):
+    for name in ENRICHED_FIELDS:
+        if name not in data:
+            continue
+        value = data[name]
+        if name in _INTERNED:
+            value = intern_str(value)
+        elif name == "characteristics":
+            value = {intern_str(k): v for k, v in value.items()}
+        elif isinstance(value, list):
+            value = list(value)
+        setattr(product, name, value)
+
+
+def stale_articles(products, *stores):
+    """Артикулы страницы, которые надо обогащать.
+
+    stores - DeltaStore / RunJournal (или None) с методом split: каждый
+    восстанавливает что может из оставшихся, остальное идёт дальше.
+    """
+    stale = {p.article for p in products}
+    for store in stores:
+        if store is not None and stale:
+            stale = store.split([p for p in products if p.article in stale])
+    return stale
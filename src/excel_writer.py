@@ -1,12 +1,16 @@
 """Экспорт в Excel."""
 
 import logging
+import time
 from pathlib import Path
 
 from openpyxl import Workbook
-from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
 from openpyxl.utils import get_column_letter
 
+from src.metrics import metrics
+
 logger = logging.getLogger(__name__)
 
 
@@ -18,6 +22,7 @@ COLUMNS = [
     ("Цена (руб.)", "price_rub", 15),
     ("Описание", "description_clean", 60),
     ("Изображения", "images_str", 80),
+    ("Файлы изображений", "image_paths_str", 60),
     ("Характеристики", "characteristics_str", 60),
     ("Продавец", "seller_name", 25),
     ("Ссылка на продавца", "seller_url", 50),
@@ -29,69 +34,102 @@ COLUMNS = [
 ]
 
 
+# стили общие на все ячейки - создаются один раз
+_BORDER = Border(
+    left=Side(style="thin"), right=Side(style="thin"),
+    top=Side(style="thin"), bottom=Side(style="thin")
+)
+_HEADER_FONT = Font(bold=True, color="FFFFFF")
+_HEADER_FILL = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+_HEADER_ALIGN = Alignment(horizontal="center", wrap_text=True)
+_CELL_ALIGN = Alignment(vertical="top", wrap_text=True)
+_CELL_STYLE = "wb_cell"
+
+
 def _style_header(ws):
-    """Стилизуем заголовки."""
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    border = Border(
-        left=Side(style="thin"), right=Side(style="thin"),
-        top=Side(style="thin"), bottom=Side(style="thin")
-    )
-    
-    # применяем стили к каждой колонке
-    col_num = 1
-    for col_info in COLUMNS:
-        name = col_info[0]
-        width = col_info[2]
-        cell = ws.cell(row=1, column=col_num, value=name)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = Alignment(horizontal="center", wrap_text=True)
-        cell.border = border
+    """Ширина колонок и стилизованные заголовки."""
+    row = []
+    for col_num, (name, _, width) in enumerate(COLUMNS, 1):
         ws.column_dimensions[get_column_letter(col_num)].width = width
-        col_num += 1
-
+        cell = WriteOnlyCell(ws, value=name)
+        cell.font = _HEADER_FONT
+        cell.fill = _HEADER_FILL
+        cell.alignment = _HEADER_ALIGN
+        cell.border = _BORDER
+        row.append(cell)
+    ws.append(row)
 
-def _write_row(ws, row, product):
-    """Пишем строку товара."""
-    border = Border(
-        left=Side(style="thin"), right=Side(style="thin"),
-        top=Side(style="thin"), bottom=Side(style="thin")
-    )
-    
-    for i, (_, attr, _) in enumerate(COLUMNS, 1):
-        val = getattr(product, attr, "")
-        cell = ws.cell(row=row, column=i, value=val)
-        cell.alignment = Alignment(vertical="top", wrap_text=True)
-        cell.border = border
 
+class XlsxBook:
+    """write_only книга с одним листом.
 
-def save_xlsx(products, filepath, sheet_name="Товары"):
-    """Сохраняем товары в xlsx."""
-    filepath = Path(filepath)
-    filepath.parent.mkdir(parents=True, exist_ok=True)
+    Строки сразу уходят во временный файл, память не растёт. Стиль
+    ячеек - именованный, регистрируется в книге один раз и потом
+    присваивается по имени - без поиска Border/Alignment на каждую
+    ячейку.
+    """
     
-    wb = Workbook()
-    ws = wb.active
-    ws.title = sheet_name
+    def __init__(self, sheet_name):
+        self.wb = Workbook(write_only=True)
+        self.ws = self.wb.create_sheet(sheet_name)
+        self.ws.freeze_panes = "A2"
+        _style_header(self.ws)
+        
+        # NamedStyle привязывается к книге - на каждую книгу свой
+        self.wb.add_named_style(NamedStyle(name=_CELL_STYLE, alignment=_CELL_ALIGN, border=_BORDER))
+        self.rows = 0
+        # в write_only основное время - ws.append, а не save: считаем оба
+        self._elapsed = 0.0
     
-    _style_header(ws)
+    def write(self, product):
+        """Пишем строку товара."""
+        self.write_values([getattr(product, attr, "") for _, attr, _ in COLUMNS])
     
-    for i, p in enumerate(products, 2):
-        _write_row(ws, i, p)
+    def write_values(self, values):
+        # значения уже в порядке COLUMNS
+        started = time.perf_counter()
+        row = []
+        for value in values:
+            cell = WriteOnlyCell(self.ws, value=value)
+            cell.style = _CELL_STYLE
+            row.append(cell)
+        self.ws.append(row)
+        self.rows += 1
+        self._elapsed += time.perf_counter() - started
     
-    ws.freeze_panes = "A2"
-    wb.save(filepath)
+    def save(self, filepath):
+        filepath = Path(filepath)
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        started = time.perf_counter()
+        self.wb.save(filepath)
+        metrics.observe("wb_xlsx_save_seconds", self._elapsed + time.perf_counter() - started)
+        return filepath
+
+
+def save_xlsx(products, filepath, sheet_name="Товары"):
+    """Сохраняем товары в xlsx (products - любой итерируемый)."""
+    book = XlsxBook(sheet_name)
+    for p in products:
+        book.write(p)
     
-    logger.info(f"Сохранено {len(products)} товаров в {filepath}")
+    filepath = book.save(filepath)
+    logger.info(f"Сохранено {book.rows} товаров в {filepath}")
     return filepath
 
 
 def save_filtered(products, filepath, filter_func):
     """Сохраняем отфильтрованные товары."""
-    filtered = [p for p in products if filter_func(p)]
-    save_xlsx(filtered, filepath, "Отфильтрованные")
-    return len(filtered)
+    count = 0
+    
+    def matching():
+        nonlocal count
+        for p in products:
+            if filter_func(p):
+                count += 1
+                yield p
+    
+    save_xlsx(matching(), filepath, "Отфильтрованные")
+    return count
 
 export_to_xlsx = save_xlsx
 export_filtered = lambda products, path, func, **kw: (Path(path), save_filtered(products, path, func))
@@ -0,0 +1,221 @@
+"""Загрузка фото товаров (--images).
+
+    python -m src.main -q "пальто" --images             # в <output>/images
+    python -m src.main -q "пальто" --images /data/photos
+
+Ссылки строятся по точному числу фото из выдачи, detail или card.json
+(pics, media.photo_count), так что 404 почти не бывает. Файлы лежат по
+содержимому: <dir>/ab/<sha256>.webp - одинаковое фото у разных
+артикулов и в разных запусках хранится один раз. index.sqlite3 рядом
+помнит, какая ссылка во что скачалась (и какие отдали 404), поэтому
+повторный запуск и продолжение после сбоя ничего не качают заново.
+Локальные пути пишутся в Product.image_paths - по одному на ссылку из
+images, для 404 и нескачавшихся пустая строка.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from urllib.parse import urlsplit
+
+import httpx
+
+from src.config import (
+    IMAGES_BUFFER,
+    IMAGES_PER_HOST,
+    IMAGES_WORKERS,
+    REQUEST_TIMEOUT,
+    RETRY_COUNT,
+    RETRY_DELAY,
+    get_headers,
+)
+from src.metrics import metrics
+from src.rate_limit import limiter
+
+logger = logging.getLogger(__name__)
+
+MISSING = 404
+
+
+class ImageStore:
+    """Файлы по sha256 и индекс ссылка -> файл. Соединение своё на поток."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        self.root.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.root / "index.sqlite3", timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            " url TEXT PRIMARY KEY,"
+            " file TEXT,"
+            " status INTEGER NOT NULL,"
+            " fetched REAL NOT NULL)"
+        )
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def lookup(self, url):
+        """(есть в индексе, путь или None для 404)."""
+        row = self._conn().execute("SELECT file, status FROM images WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return False, None
+        file, status = row
+        if status == MISSING:
+            return True, None
+        path = self.root / file
+        # файл могли удалить руками - тогда качаем заново
+        return (True, path) if path.exists() else (False, None)
+
+    def put(self, url, content):
+        digest = hashlib.sha256(content).hexdigest()
+        ext = PurePosixPath(urlsplit(url).path).suffix or ".webp"
+        file = f"{digest[:2]}/{digest}{ext}"
+        path = self.root / file
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(content)
+            os.replace(tmp, path)
+        self._record(url, file, 200)
+        return path
+
+    def missing(self, url):
+        self._record(url, None, MISSING)
+
+    def _record(self, url, file, status):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO images (url, file, status, fetched) VALUES (?, ?, ?, ?)",
+            (url, file, status, time.time()),
+        )
+
+
+class ImageDownloader:
+    """Пул потоков и по httpx клиенту (со своим пулом соединений) на хост."""
+
+    def __init__(self, store, workers=IMAGES_WORKERS, per_host=IMAGES_PER_HOST,
+                 buffer=IMAGES_BUFFER, proxy=None):
+        self.store = store
+        self.per_host = per_host
+        self.buffer = buffer
+        self.proxy = proxy
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._clients = {}
+        self._lock = threading.Lock()
+        self.stats = {"downloaded": 0, "reused": 0, "missing": 0, "failed": 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _client(self, host):
+        with self._lock:
+            client = self._clients.get(host)
+            if client is None:
+                client = self._clients[host] = httpx.Client(
+                    headers=get_headers(),
+                    timeout=REQUEST_TIMEOUT,
+                    follow_redirects=True,
+                    proxy=self.proxy,
+                    limits=httpx.Limits(max_connections=self.per_host,
+                                        max_keepalive_connections=self.per_host),
+                )
+            return client
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def fetch(self, url):
+        """Путь к файлу или None (404 / не скачалось)."""
+        known, path = self.store.lookup(url)
+        if known:
+            self._count("reused" if path else "missing")
+            return path
+
+        client = self._client(urlsplit(url).netloc)
+        for attempt in range(RETRY_COUNT):
+            limiter.acquire(url)
+            started = time.perf_counter()
+            try:
+                resp = client.get(url)
+            except httpx.RequestError as e:
+                metrics.request(url, "error", time.perf_counter() - started, attempt)
+                logger.debug(f"Фото {url}: {e}")
+                metrics.sleep(RETRY_DELAY * (attempt + 1), "retry")
+                continue
+            metrics.request(url, resp.status_code, time.perf_counter() - started, attempt)
+            limiter.feedback(url, resp.status_code, resp.headers.get("Retry-After"))
+            if resp.status_code == 200:
+                self._count("downloaded")
+                return self.store.put(url, resp.content)
+            if resp.status_code == 404:
+                self.store.missing(url)
+                self._count("missing")
+                return None
+            if resp.status_code == 429:
+                continue  # ждём в limiter.acquire
+            if resp.status_code < 500:
+                break
+            metrics.sleep(RETRY_DELAY * (attempt + 1), "retry")
+        self._count("failed")
+        return None
+
+    def _paths(self, futures):
+        # по месту на ссылку, как в images; не скачалось - пустая строка
+        paths = []
+        for future in futures:
+            try:
+                path = future.result()
+            except Exception as e:
+                logger.debug(f"Фото: {e}")
+                self._count("failed")
+                path = None
+            paths.append(str(path) if path is not None else "")
+        return paths
+
+    def iter_fetch(self, products):
+        """Пропускаем поток товаров: фото качаются фоном, товар отдаётся
+        по порядку, когда его фото готовы. В работе до buffer товаров."""
+        pending = deque()
+        try:
+            for p in products:
+                pending.append((p, [self._executor.submit(self.fetch, url) for url in p.images]))
+                while len(pending) >= self.buffer or (pending and all(f.done() for f in pending[0][1])):
+                    p, futures = pending.popleft()
+                    p.image_paths = self._paths(futures)
+                    yield p
+            while pending:
+                p, futures = pending.popleft()
+                p.image_paths = self._paths(futures)
+                yield p
+        finally:
+            for _, futures in pending:
+                for f in futures:
+                    f.cancel()
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
+        s = self.stats
+        logger.info(f"Фото: скачано {s['downloaded']}, уже были {s['reused']}, "
+                    f"нет на сервере {s['missing']}, ошибок {s['failed']}")
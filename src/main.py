@@ -1,14 +1,31 @@
 """Парсер каталога Wildberries."""
 
 import argparse
+import itertools
 import logging
 import sys
 from datetime import datetime
 from pathlib import Path
 
-from src.cache import clear_cache
-from src.config import DEFAULT_FILTER
-from src.excel_writer import save_xlsx, save_filtered
+from src.batch import read_queries, run_batch
+from src.cache import BACKENDS, cache_stats, clear_cache, set_backend
+from src.checkpoint import RunJournal, journal_path
+from src.config import (
+    ASYNC_CONCURRENCY,
+    BROWSER_POOL_SIZE,
+    CACHE_BACKEND,
+    CHECKPOINT,
+    CHECKPOINT_KEEP,
+    DEFAULT_FILTER,
+    DELTA_PATH,
+    EXPORT_FORMATS,
+    METRICS_HOST,
+    SEARCH_WINDOW,
+)
+from src.metrics import MetricsExporter, metrics
+from src.query import QueryError, parse_query
+from src.sinks import SINKS, export_all
+from src.work_queue import WorkQueue, run_queue
 
 
 def setup_logging(verbose=False):
@@ -25,33 +42,73 @@ def parse_args():
     
     parser.add_argument("-q", "--query", default="пальто из натуральной шерсти",
                         help="Поисковый запрос")
+    parser.add_argument("--queries", metavar="FILE",
+                        help="Файл с запросами (по одному на строку) - все за один запуск")
+    parser.add_argument("--queue", metavar="FILE",
+                        help="Только поиск: товары в очередь, обогащают воркеры (python -m src.worker FILE)")
     parser.add_argument("-p", "--pages", type=int, default=10,
                         help="Кол-во страниц")
     parser.add_argument("-o", "--output", default="output",
                         help="Папка для результатов")
+    parser.add_argument("-f", "--format", default=",".join(EXPORT_FORMATS),
+                        help=f"Форматы выгрузки через запятую: {', '.join(SINKS)}")
     parser.add_argument("-w", "--workers", type=int, default=5,
                         help="Потоки (для httpx режима)")
+    parser.add_argument("--search-window", type=int, default=SEARCH_WINDOW,
+                        help="Страниц поиска одновременно (для HTTP режимов)")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Асинхронный HTTP режим (httpx.AsyncClient, HTTP/2)")
+    parser.add_argument("--concurrency", type=int, default=ASYNC_CONCURRENCY,
+                        help="Одновременных запросов в async режиме")
     
     parser.add_argument("--no-enrich", action="store_true",
                         help="Без обогащения данных")
+    parser.add_argument("--delta", nargs="?", const=DELTA_PATH,
+                        help=f"Обогащать только новые/изменившиеся товары, остальное - из "
+                             f"прошлых запусков (файл, по умолчанию {DELTA_PATH})")
+    parser.add_argument("--resume", metavar="RUN_ID",
+                        help="Продолжить прерванный запуск (id пишется в лог при старте)")
+    parser.add_argument("--no-checkpoint", action="store_true",
+                        help="Без журнала запуска (нельзя будет продолжить через --resume)")
+    parser.add_argument("--images", nargs="?", const="", metavar="DIR",
+                        help="Скачать фото товаров (по умолчанию в <output>/images)")
     parser.add_argument("--no-parallel", action="store_true",
                         help="Без многопоточности")
     parser.add_argument("--no-cache", action="store_true",
                         help="Без кэша")
     parser.add_argument("--clear-cache", action="store_true",
                         help="Очистить кэш")
+    parser.add_argument("--cache-backend", choices=sorted(BACKENDS), default=CACHE_BACKEND,
+                        help="Хранилище кэша")
     
     parser.add_argument("--browser", action="store_true",
                         help="Режим браузера (Playwright)")
+    parser.add_argument("--hybrid", action="store_true",
+                        help="Браузер только для сессии, запросы через httpx")
     parser.add_argument("--show-browser", action="store_true",
                         help="Показать окно браузера")
+    parser.add_argument("--no-block", action="store_true",
+                        help="Не блокировать картинки/шрифты/трекеры в браузере")
+    parser.add_argument("--browser-pool", type=int, default=1,
+                        help=f"Страниц браузера параллельно (>1 - async Playwright, "
+                             f"например {BROWSER_POOL_SIZE})")
     parser.add_argument("--proxy", help="Прокси (http://...)")
     
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="Метрики в формате Prometheus в файл (обновляется по ходу)")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Отдавать метрики на http://HOST:PORT/metrics")
+    parser.add_argument("--metrics-host", default=METRICS_HOST,
+                        help=f"Адрес для --metrics-port ({METRICS_HOST})")
+    
     parser.add_argument("-v", "--verbose", action="store_true")
     
     parser.add_argument("--min-rating", type=float, default=DEFAULT_FILTER["min_rating"])
     parser.add_argument("--max-price", type=int, default=DEFAULT_FILTER["max_price"])
     parser.add_argument("--country", default=DEFAULT_FILTER["country"])
+    parser.add_argument("--where", action="append", default=[],
+                        help='Условие по характеристикам, например \'Состав ~ "шерсть 100%%"\' '
+                             '(можно несколько - через and)')
     
     return parser.parse_args()
 
@@ -62,6 +119,49 @@ def main():
     
     logger = logging.getLogger(__name__)
     
+    formats = [f.strip() for f in args.format.split(",") if f.strip()]
+    unknown = [f for f in formats if f not in SINKS]
+    if unknown or not formats:
+        logger.error(f"Неизвестный формат: {', '.join(unknown) or args.format}")
+        return 2
+    
+    try:
+        query = parse_query(*args.where)
+    except QueryError as e:
+        logger.error(f"--where: {e}")
+        return 2
+    
+    queries = None
+    if args.queue and (args.queries or args.resume):
+        logger.error("--queue не поддерживается вместе с --queries и --resume")
+        return 2
+    if args.queries:
+        if args.resume:
+            logger.error("--resume не поддерживается вместе с --queries")
+            return 2
+        queries = read_queries(args.queries)
+        if not queries:
+            logger.error(f"В {args.queries} нет запросов")
+            return 2
+    
+    out_dir = Path(args.output)
+    journal = None
+    if args.resume:
+        try:
+            journal = RunJournal.resume(out_dir, args.resume)
+        except FileNotFoundError as e:
+            logger.error(str(e))
+            return 2
+        # запрос и страницы - как в прерванном запуске
+        args.query = journal.meta.get("query", args.query)
+        args.pages = journal.meta.get("pages", args.pages)
+        args.no_enrich = not journal.meta.get("enrich", not args.no_enrich)
+        run_id = args.resume
+    else:
+        run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+    
+    set_backend(args.cache_backend)
+    
     if args.clear_cache:
         logger.info("Очистка кэша...")
         clear_cache()
@@ -69,34 +169,127 @@ def main():
     logger.info("=" * 60)
     logger.info("ПАРСЕР WILDBERRIES")
     logger.info("=" * 60)
-    logger.info(f"Запрос: '{args.query}'")
+    if queries:
+        logger.info(f"Запросов: {len(queries)} (из {args.queries})")
+    else:
+        logger.info(f"Запрос: '{args.query}'")
     logger.info(f"Страниц: {args.pages}")
     logger.info(f"Кэш: {'нет' if args.no_cache else 'да'}")
-    logger.info(f"Обогащение: {'нет' if args.no_enrich else 'да'}")
+    if args.queue:
+        logger.info(f"Обогащение: очередь {args.queue}")
+    else:
+        logger.info(f"Обогащение: {'нет' if args.no_enrich else 'да'}")
+    if args.delta and not args.no_enrich and not args.queue:
+        logger.info(f"Дельта: {args.delta}")
+    images_dir = Path(args.images) if args.images else out_dir / "images"
+    if args.images is not None:
+        logger.info(f"Фото: {images_dir}")
+    logger.info(f"Форматы: {', '.join(formats)}")
+    if args.resume:
+        logger.info(f"Продолжаем запуск: {run_id}")
+    elif CHECKPOINT and not args.no_checkpoint and not queries and not args.queue:
+        logger.info(f"Запуск: {run_id} (продолжить: --resume {run_id})")
     
     if args.browser:
         logger.info(f"Режим: браузер")
         logger.info(f"Headless: {'нет' if args.show_browser else 'да'}")
+        if args.browser_pool > 1 and not args.queue:
+            logger.info(f"Пул страниц: {args.browser_pool}")
+    elif args.hybrid:
+        logger.info(f"Режим: гибрид (браузер + HTTP)")
+    elif args.use_async and not args.queue:
+        logger.info(f"Режим: HTTP async (до {args.concurrency} запросов)")
     else:
         logger.info(f"Режим: HTTP")
         if args.proxy:
             logger.info(f"Прокси: {args.proxy[:30]}...")
     logger.info("=" * 60)
     
-    out_dir = Path(args.output)
     out_dir.mkdir(parents=True, exist_ok=True)
     
-    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    full_path = out_dir / f"catalog_full_{ts}.xlsx"
-    filtered_path = out_dir / f"catalog_filtered_{ts}.xlsx"
+    full_base = out_dir / f"catalog_full_{run_id}"
+    filtered_base = out_dir / f"catalog_filtered_{run_id}"
+    
+    # журнал - на один запрос, в пакетном режиме не ведётся;
+    # в режиме очереди всё и так лежит в файле очереди
+    if journal is None and CHECKPOINT and not args.no_checkpoint and not queries and not args.queue:
+        journal = RunJournal(
+            journal_path(out_dir, run_id),
+            meta={"query": args.query, "pages": args.pages, "enrich": not args.no_enrich},
+        )
+    
+    def check_filter(p):
+        return p.matches_filter(
+            min_rating=args.min_rating,
+            max_price=args.max_price,
+            country=args.country,
+        ) and (query is None or query.matches(p))
+    
+    delta = None
+    images = None
+    exporter = None
+    finished = False
+    
+    def track(products):
+        # фото качаем до записи в дельту/журнал - туда попадут и пути
+        if images is not None:
+            products = images.iter_fetch(products)
+        if delta is not None:
+            products = delta.track(products)
+        return products
     
     try:
+        if args.metrics or args.metrics_port is not None:
+            exporter = MetricsExporter(metrics, path=args.metrics, port=args.metrics_port,
+                                       host=args.metrics_host)
+        if args.delta and not args.no_enrich and not args.queue:
+            from src.delta import DeltaStore
+            delta = DeltaStore(args.delta)
+        if args.images is not None:
+            from src.images import ImageDownloader, ImageStore
+            images = ImageDownloader(ImageStore(images_dir), proxy=args.proxy)
+        
         # выбираем парсер в зависимости от режима
-        if args.browser:
+        # (координатору очереди нужен только поиск - хватает синхронного)
+        if args.browser and args.browser_pool > 1 and not args.queue:
+            from src.wb_browser_async import AsyncWBBrowserParser
+            parser = AsyncWBBrowserParser(
+                use_cache=not args.no_cache,
+                headless=not args.show_browser,
+                pool_size=args.browser_pool,
+                block_resources=not args.no_block,
+                delta=delta,
+                journal=journal,
+            )
+        elif args.browser:
             from src.wb_browser import WBBrowserParser
             parser = WBBrowserParser(
                 use_cache=not args.no_cache,
                 headless=not args.show_browser,
+                block_resources=not args.no_block,
+                delta=delta,
+                journal=journal,
+            )
+        elif args.hybrid:
+            from src.wb_hybrid import HybridParser
+            parser = HybridParser(
+                use_cache=not args.no_cache,
+                max_workers=args.workers,
+                proxy=args.proxy,
+                search_window=args.search_window,
+                headless=not args.show_browser,
+                delta=delta,
+                journal=journal,
+            )
+        elif args.use_async and not args.queue:
+            from src.wb_async import AsyncWildberriesParser
+            parser = AsyncWildberriesParser(
+                use_cache=not args.no_cache,
+                concurrency=args.concurrency,
+                proxy=args.proxy,
+                search_window=args.search_window,
+                delta=delta,
+                journal=journal,
             )
         else:
             # HTTP режим (может блокироваться)
@@ -105,55 +298,87 @@ def main():
                 use_cache=not args.no_cache,
                 max_workers=args.workers,
                 proxy=args.proxy,
+                search_window=args.search_window,
+                delta=delta,
+                journal=journal,
             )
         
         with parser:
             logger.info("Парсинг...")
             start = datetime.now()
             
-            if args.browser:
-                products = parser.parse(
-                    args.query,
-                    max_pages=args.pages,
-                    enrich=not args.no_enrich,
-                )
-            else:
-                products = parser.parse_all(
-                    args.query,
+            if queries:
+                results, (total, filtered_count) = run_batch(
+                    parser, queries, formats, out_dir, run_id, check_filter,
                     max_pages=args.pages,
                     enrich=not args.no_enrich,
                     parallel=not args.no_parallel,
+                    track=track,
                 )
+                full_base = out_dir / f"catalog_full_{run_id}_all"
+                filtered_base = out_dir / f"catalog_filtered_{run_id}_all"
+            elif args.queue:
+                total, filtered_count = run_queue(
+                    parser, WorkQueue(args.queue), args.query, args.pages,
+                    formats, full_base, filtered_base, check_filter, track=track,
+                )
+                if not total:
+                    logger.warning("Ничего не найдено")
+                    finished = True
+                    return 1
+            else:
+                # товары идут в экспорт по мере обогащения, без общего списка
+                if args.browser:
+                    products = parser.iter_parse(
+                        args.query,
+                        max_pages=args.pages,
+                        enrich=not args.no_enrich,
+                    )
+                else:
+                    products = parser.iter_parse(
+                        args.query,
+                        max_pages=args.pages,
+                        enrich=not args.no_enrich,
+                        parallel=not args.no_parallel,
+                    )
             
-            elapsed = datetime.now() - start
-            logger.info(f"Время: {elapsed}")
-            
-            if not products:
-                logger.warning("Ничего не найдено")
-                return 1
-            
-            logger.info(f"Найдено: {len(products)}")
+                # фото и дельта - по мере выгрузки
+                products = track(products)
+                if journal is not None:
+                    products = journal.track(products)
             
-            save_xlsx(products, full_path)
-            logger.info(f"Полный каталог: {full_path}")
+                first = next(products, None)
+                if first is None:
+                    logger.warning("Ничего не найдено")
+                    finished = True
+                    return 1
             
-            def check_filter(p):
-                return p.matches_filter(
-                    min_rating=args.min_rating,
-                    max_price=args.max_price,
-                    country=args.country,
+                total, filtered_count, paths = export_all(
+                    itertools.chain([first], products), formats, full_base, filtered_base, check_filter,
                 )
             
-            filtered_count = save_filtered(products, filtered_path, check_filter)
-            logger.info(f"Отфильтровано: {filtered_path} ({filtered_count} шт.)")
+            elapsed = datetime.now() - start
+            logger.info(f"Время: {elapsed}")
+            logger.info(f"Полный каталог: {full_base}.*")
+            logger.info(f"Отфильтровано: {filtered_base}.* ({filtered_count} шт.)")
             
             logger.info("=" * 60)
             logger.info("ИТОГО")
-            logger.info(f"  Всего: {len(products)}")
+            if queries:
+                for q, (q_total, q_filtered) in results.items():
+                    logger.info(f"  '{q}': {q_total} / {q_filtered}")
+            logger.info(f"  Всего: {total}")
             logger.info(f"  Фильтр: {filtered_count}")
             logger.info(f"  Время: {elapsed}")
             logger.info(f"  Фильтр: рейтинг>={args.min_rating}, цена<={args.max_price}, страна={args.country}")
+            if query is not None:
+                logger.info(f"  Условие: {query.text}")
+            stats = cache_stats()
+            if stats:
+                logger.info(f"  Кэш в памяти: {stats['hits']} попаданий, {stats['misses']} промахов "
+                            f"({stats['hit_ratio']:.0%})")
             logger.info("=" * 60)
+            finished = True
             
     except KeyboardInterrupt:
         logger.info("Прервано (Ctrl+C)")
@@ -161,6 +386,28 @@ def main():
     except Exception as e:
         logger.exception(f"Ошибка: {e}")
         return 1
+    finally:
+        if delta is not None:
+            delta.close()
+        if images is not None:
+            images.close()
+        if exporter is not None:
+            exporter.close()
+        if journal is not None:
+            if finished and not CHECKPOINT_KEEP:
+                journal.remove()
+            else:
+                journal.close()
+                if not finished:
+                    logger.info(f"Продолжить: python -m src.main -o {args.output} --resume {run_id}")
+        # сводка по метрикам - рядом с выгрузками, даже если упали
+        logger.info(f"Метрики: {metrics.headline()}")
+        summary_path = out_dir / f"metrics_{run_id}.json"
+        try:
+            metrics.write_summary(summary_path)
+            logger.info(f"Сводка метрик: {summary_path}")
+        except OSError as e:
+            logger.warning(f"Метрики: не записали {summary_path}: {e}")
     
     return 0
 
@@ -0,0 +1,291 @@
+"""Метрики запуска: запросы, задержки, ретраи, паузы, кэш.
+
+    python -m src.main -q "пальто" --metrics output/wb.prom --metrics-port 9108
+
+Счётчики и гистограммы в памяти процесса, общие для всех потоков и
+корутин. Наружу - в формате Prometheus: файлом (для textfile коллектора
+node_exporter, переписывается раз в METRICS_INTERVAL сек) и/или по
+HTTP на /metrics. В конце main() сводка пишется в JSON рядом с
+выгрузками.
+
+    wb_requests_total{endpoint,status}   ответы API (status=error - не ответил)
+    wb_request_seconds{endpoint}         время запроса, гистограмма
+    wb_retries_total{endpoint}           повторы запросов
+    wb_sleep_seconds_total{reason}       паузы: лимитер, ретраи, браузер
+    wb_cache_total{result}               чтения кэша: hit / stale / miss
+    wb_xlsx_save_seconds                 запись строк и сохранение xlsx, гистограмма
+    wb_rate_limit_rps{host}              текущая скорость лимитера
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from src.config import METRICS_BUCKETS, METRICS_HOST, METRICS_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# что есть что - для # HELP / # TYPE
+_META = {
+    "wb_requests_total": ("counter", "Ответы API по эндпоинту и коду"),
+    "wb_request_seconds": ("histogram", "Время запроса к API, сек"),
+    "wb_retries_total": ("counter", "Повторы запросов"),
+    "wb_sleep_seconds_total": ("counter", "Время в паузах, сек"),
+    "wb_cache_total": ("counter", "Чтения кэша"),
+    "wb_xlsx_save_seconds": ("histogram", "Запись строк и сохранение xlsx, сек"),
+    "wb_rate_limit_rps": ("gauge", "Скорость лимитера на хост, req/s"),
+}
+
+
+def endpoint(url):
+    """Имя эндпоинта для метки: search, detail, card, image или хост."""
+    parts = urlsplit(url)
+    host = parts.hostname or ""
+    if host.startswith("search."):
+        return "search"
+    if host.startswith("card."):
+        return "detail"
+    if host.startswith("basket-"):
+        return "image" if "/images/" in parts.path else "card"
+    return host
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Metrics:
+    """Реестр метрик. Метки - именованные аргументы."""
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}
+        self._hists = {}
+        self.started = time.time()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        # последняя корзина - +Inf
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = _Histogram(len(self.buckets) + 1)
+            h.counts[i] += 1
+            h.sum += value
+            h.count += 1
+
+    # --- то, что зовут парсеры ---
+
+    def request(self, url, status, seconds, attempt=0):
+        """Ответ (или его отсутствие - status "error") на запрос к url."""
+        name = endpoint(url)
+        self.inc("wb_requests_total", endpoint=name, status=str(status))
+        self.observe("wb_request_seconds", seconds, endpoint=name)
+        if attempt:
+            self.inc("wb_retries_total", endpoint=name)
+
+    def sleep(self, seconds, reason):
+        if seconds > 0:
+            self.inc("wb_sleep_seconds_total", seconds, reason=reason)
+            time.sleep(seconds)
+
+    async def asleep(self, seconds, reason):
+        if seconds > 0:
+            self.inc("wb_sleep_seconds_total", seconds, reason=reason)
+            await asyncio.sleep(seconds)
+
+    # --- выгрузка ---
+
+    def _snapshot(self):
+        with self._lock:
+            values = dict(self._values)
+            hists = {k: (list(h.counts), h.sum, h.count) for k, h in self._hists.items()}
+        return values, hists
+
+    def prometheus(self):
+        """Текстовый формат Prometheus 0.0.4."""
+        values, hists = self._snapshot()
+        names = sorted({k[0] for k in values} | {k[0] for k in hists})
+        lines = []
+        for name in names:
+            kind, help_text = _META.get(name, ("untyped", ""))
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (n, labels), value in sorted(values.items()):
+                if n == name:
+                    lines.append(f"{name}{_labels(labels)} {_num(value)}")
+            for (n, labels), (counts, total, count) in sorted(hists.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, c in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += c
+                    le = "+Inf" if bound == float("inf") else _num(bound)
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {_num(total)}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Сводка для JSON: счётчики и по гистограммам count/avg/p50/p95."""
+        values, hists = self._snapshot()
+        result = {"elapsed": round(time.time() - self.started, 3), "metrics": {}}
+        for (name, labels), value in sorted(values.items()):
+            result["metrics"].setdefault(name, []).append(
+                {**dict(labels), "value": round(value, 3) if isinstance(value, float) else value}
+            )
+        for (name, labels), (counts, total, count) in sorted(hists.items()):
+            result["metrics"].setdefault(name, []).append({
+                **dict(labels),
+                "count": count,
+                "avg": round(total / count, 4) if count else 0.0,
+                "p50": self._quantile(counts, count, 0.5),
+                "p95": self._quantile(counts, count, 0.95),
+            })
+        return result
+
+    def headline(self):
+        """Главное одной строкой - для лога в конце запуска."""
+        values, _ = self._snapshot()
+
+        def total(name, **match):
+            return sum(
+                v for (n, labels), v in values.items()
+                if n == name and all(dict(labels).get(k) == m for k, m in match.items())
+            )
+
+        requests = total("wb_requests_total")
+        limited = total("wb_requests_total", status="429")
+        hits = total("wb_cache_total", result="hit")
+        lookups = total("wb_cache_total")
+        return (f"запросов {requests}, 429: {limited} ({limited / requests if requests else 0:.1%}), "
+                f"ретраев {total('wb_retries_total')}, паузы {total('wb_sleep_seconds_total'):.0f} сек, "
+                f"кэш {hits}/{lookups}")
+
+    def _quantile(self, counts, count, q):
+        # верхняя граница корзины, куда попал квантиль (None - выше всех)
+        if not count:
+            return None
+        seen = 0
+        for bound, c in zip(self.buckets, counts):
+            seen += c
+            if seen >= q * count:
+                return bound
+        return None
+
+    def write_prometheus(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(self.prometheus(), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def write_summary(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.summary(), ensure_ascii=False, indent=1), encoding="utf-8")
+        return path
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return "{" + inner + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _num(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsExporter:
+    """Файл для textfile коллектора (раз в interval сек) и/или /metrics по HTTP."""
+
+    def __init__(self, registry, path=None, port=None, host=METRICS_HOST, interval=METRICS_INTERVAL):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._server = None
+
+        if port is not None:
+            self._server = ThreadingHTTPServer((host, port), _handler(registry))
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+            logger.info(f"Метрики: http://{host}:{self._server.server_address[1]}/metrics")
+        if path is not None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self._write()
+
+    def _write(self):
+        try:
+            self.registry.write_prometheus(self.path)
+        except OSError as e:
+            logger.warning(f"Метрики: не записали {self.path}: {e}")
+
+    def close(self):
+        self._stop.set()
+        if self.path is not None:
+            self._write()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def _handler(registry):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+# один на процесс, как limiter
+metrics = Metrics()
@@ -1,12 +1,28 @@
 """Модели данных."""
 
 import re
+import sys
 from dataclasses import dataclass, field
 
+_TAG_RE = re.compile(r'<[^>]+>')
+_SPACE_RE = re.compile(r'\s+')
 
-@dataclass
+
+def intern_str(value):
+    """Бренды, продавцы, страны и названия характеристик повторяются
+    тысячи раз - храним одну копию строки."""
+    return sys.intern(value) if type(value) is str else value
+
+
+@dataclass(slots=True)
 class Product:
-    """Товар WB."""
+    """Товар WB.
+
+    description_clean считается один раз и запоминается вместе с
+    описанием; заменили описание - пересчитываем. *_str списков и
+    словарей не кэшируются: их меняют на месте, а export_all и так
+    собирает строку товара один раз.
+    """
     
     url: str
     article: int
@@ -23,6 +39,16 @@ class Product:
     feedbacks_count: int = 0
     brand: str = ""
     country: str = ""
+    # скачанные фото (--images, src/images.py): путь на каждую ссылку
+    # из images, "" - не скачалось
+    image_paths: list[str] = field(default_factory=list)
+    # description_clean: (description, результат) - слот, а не dict
+    _clean: tuple | None = field(default=None, init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        self.brand = intern_str(self.brand)
+        self.seller_name = intern_str(self.seller_name)
+        self.country = intern_str(self.country)
     
     @property
     def price_rub(self):
@@ -32,6 +58,10 @@ class Product:
     def images_str(self):
         return ", ".join(self.images)
     
+    @property
+    def image_paths_str(self):
+        return ", ".join(self.image_paths)
+    
     @property
     def sizes_str(self):
         return ", ".join(self.sizes)
@@ -45,16 +75,12 @@ class Product:
         """Убираем HTML теги из описания."""
         if not self.description:
             return ""
-        # удаляем все теги
-        text = re.sub(r'<[^>]+>', ' ', self.description)
-        # заменяем HTML-сущности
-        text = text.replace('&nbsp;', ' ')
-        text = text.replace('&amp;', '&')
-        text = text.replace('&lt;', '<')
-        text = text.replace('&gt;', '>')
-        # убираем лишние пробелы
-        text = re.sub(r'\s+', ' ', text)
-        return text.strip()
+        hit = self._clean
+        if hit is not None and hit[0] is self.description:
+            return hit[1]
+        value = _clean_html(self.description)
+        self._clean = (self.description, value)
+        return value
     
     def matches_filter(self, min_rating=4.5, max_price=10000, country="Россия"):
         """Проверка фильтра."""
@@ -76,3 +102,16 @@ class Product:
             return False
         
         return True
+
+
+def _clean_html(text):
+    # удаляем все теги
+    text = _TAG_RE.sub(' ', text)
+    # заменяем HTML-сущности
+    text = text.replace('&nbsp;', ' ')
+    text = text.replace('&amp;', '&')
+    text = text.replace('&lt;', '<')
+    text = text.replace('&gt;', '>')
+    # убираем лишние пробелы
+    text = _SPACE_RE.sub(' ', text)
+    return text.strip()
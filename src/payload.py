@@ -0,0 +1,105 @@
+"""Ответы API: быстрый JSON и обрезка до нужных полей.
+
+loads/dumps - orjson, если установлен (pip install orjson), иначе
+стандартный json; выбор - JSON_BACKEND в config.py. dumps всегда
+отдаёт UTF-8 байты без экранирования кириллицы, как
+json.dumps(..., ensure_ascii=False).encode().
+
+Из поиска, detail и card.json парсер читает полтора десятка полей,
+а приходит и кэшируется всё: stocks по складам, логистика, цены по
+всем вариантам, тексты. prune оставляет только поля из схемы - то,
+что читают _product_from_item, _parse_sizes, _apply_detail и
+_apply_card (включая число фото - pics, media.photo_count). Так и в
+кэше меньше, и чтение из него быстрее.
+"""
+
+import json
+import logging
+
+from src.config import CACHE_PRUNE, JSON_BACKEND
+
+logger = logging.getLogger(__name__)
+
+
+def _orjson():
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson
+
+
+def _make_backend(name):
+    if name == "auto":
+        name = "orjson" if _orjson() else "json"
+    if name == "orjson":
+        orjson = _orjson()
+        if orjson is not None:
+            # int ключи бывают в наших словарях - стандартный json их переваривает
+            option = orjson.OPT_NON_STR_KEYS
+            return "orjson", orjson.loads, lambda obj: orjson.dumps(obj, option=option)
+        logger.warning("orjson не установлен, JSON разбирается стандартным json")
+
+    def dumps(obj):
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+    return "json", json.loads, dumps
+
+
+BACKEND, loads, dumps = _make_backend(JSON_BACKEND)
+
+
+# схемы: поле -> вложенная схема (None - значение целиком);
+# для списков схема применяется к каждому элементу
+_SIZE = {
+    "origName": None,
+    "name": None,
+    "price": {"product": None},
+    "stocks": {"qty": None},
+}
+ITEM_FIELDS = {
+    "id": None,
+    "name": None,
+    "brand": None,
+    "supplier": None,
+    "supplierId": None,
+    "reviewRating": None,
+    "feedbacks": None,
+    "pics": None,
+    "sizes": _SIZE,
+}
+CARD_FIELDS = {
+    "description": None,
+    "options": {"name": None, "value": None},
+    "compositions": {"name": None, "value": None},
+    "media": {"photo_count": None},
+}
+SCHEMAS = {
+    "search": {"data": {"products": ITEM_FIELDS}},
+    "detail": ITEM_FIELDS,
+    "card": CARD_FIELDS,
+}
+
+
+def prune(data, schema):
+    """Оставляем только поля схемы (рекурсивно)."""
+    if schema is None:
+        return data
+    if isinstance(data, dict):
+        return {key: prune(data[key], sub) for key, sub in schema.items() if key in data}
+    if isinstance(data, list):
+        return [prune(item, schema) for item in data]
+    return data
+
+
+def prune_payload(prefix, data):
+    """Обрезка по префиксу ключа кэша: search_<запрос> -> SCHEMAS["search"].
+    Неизвестные префиксы и CACHE_PRUNE = False - как есть. Если от ответа
+    ничего не осталось (WB поменял формат) - тоже как есть, чтобы пустой
+    словарь не приняли за незагрузившуюся страницу."""
+    if not CACHE_PRUNE or not prefix or not data:
+        return data
+    schema = SCHEMAS.get(prefix.split("_", 1)[0])
+    if schema is None:
+        return data
+    return prune(data, schema) or data
@@ -0,0 +1,372 @@
+"""Фильтры по характеристикам: маленький язык запросов и инвертированный индекс.
+
+    Состав ~ "шерсть 100%" and (Цвет = черный or Цвет = серый) and not Капюшон
+    Плотность >= 300 and Размер = 48
+
+Ключ - название характеристики (можно с пробелами, без кавычек),
+дальше оператор и значение:
+
+    =  / !=            значение или одна из его частей через "," / ";"
+    ~  / !~            все слова идут подряд в значении
+    < <= > >=          по первому числу в значении
+    (только ключ)      характеристика есть
+
+Условия связываются and / or / not и скобками. Регистр, "ё" и лишние
+пробелы не важны. Размеры товара (Product.sizes) доступны как "Размер".
+
+CharIndex строится по каталогу один раз: для каждого ключа, значения
+и слова - отсортированный список номеров товаров, так что запрос -
+это пересечение/объединение этих списков, а не проход по товарам.
+Query.matches проверяет один Product - для потоковой выгрузки в main.
+"""
+
+import re
+from collections import defaultdict
+
+import numpy as np
+
+SIZE_KEY = "размер"
+
+_SPACE_RE = re.compile(r"\s+")
+_WORD_RE = re.compile(r"\w+%?")
+_PART_RE = re.compile(r"[,;]")
+_NUMBER_RE = re.compile(r"-?\d+(?:[.,]\d+)?")
+_TOKEN_RE = re.compile(r"""\s*(?:(!=|<=|>=|!~|[=~<>()])|"([^"]*)"|'([^']*)'|([^\s()=!~<>"']+))""")
+
+OPERATORS = ("=", "!=", "~", "!~", "<", "<=", ">", ">=")
+_KEYWORDS = {"and", "or", "not"}
+_EMPTY = np.empty(0, dtype=np.intp)
+
+
+class QueryError(ValueError):
+    """Ошибка в тексте запроса."""
+
+
+def normalize(text):
+    return _SPACE_RE.sub(" ", str(text).lower().replace("ё", "е")).strip()
+
+
+def _words(text):
+    return tuple(_WORD_RE.findall(text))
+
+
+def _parts(value):
+    # "черный, серый" -> ищется и целиком, и по частям
+    parts = {value}
+    for part in _PART_RE.split(value):
+        part = part.strip()
+        if part:
+            parts.add(part)
+    return parts
+
+
+def _number(text):
+    m = _NUMBER_RE.search(text)
+    return float(m.group().replace(",", ".")) if m else None
+
+
+def _contains(words, phrase):
+    n = len(phrase)
+    return any(words[i:i + n] == phrase for i in range(len(words) - n + 1))
+
+
+def product_fields(product):
+    """{ключ: [значения]} товара, всё нормализовано - то, что видит запрос."""
+    fields = defaultdict(list)
+    for name, value in product.characteristics.items():
+        fields[normalize(name)].append(normalize(value))
+    for size in product.sizes:
+        fields[SIZE_KEY].append(normalize(size))
+    return fields
+
+
+def _compare(number, op, target):
+    if op == "<":
+        return number < target
+    if op == "<=":
+        return number <= target
+    if op == ">":
+        return number > target
+    return number >= target
+
+
+class CharIndex:
+    """Инвертированный индекс характеристик каталога.
+
+    keys: ключ -> товары, где он есть; values: ключ -> {значение: товары};
+    words: (ключ, слово) -> товары. Списки - отсортированные массивы
+    индексов, как у Catalog.filter.
+    """
+
+    def __init__(self, products):
+        keys = defaultdict(list)
+        values = defaultdict(lambda: defaultdict(list))
+        words = defaultdict(list)
+        # для фраз из нескольких слов - проверка порядка у кандидатов
+        self._phrases = defaultdict(dict)
+        self.size = 0
+
+        for i, product in enumerate(products):
+            self.size += 1
+            for key, vals in product_fields(product).items():
+                keys[key].append(i)
+                seen = set()
+                token_lists = []
+                for value in vals:
+                    for part in _parts(value):
+                        posting = values[key][part]
+                        if not posting or posting[-1] != i:
+                            posting.append(i)
+                    tokens = _words(value)
+                    token_lists.append(tokens)
+                    for word in tokens:
+                        if word not in seen:
+                            seen.add(word)
+                            words[(key, word)].append(i)
+                self._phrases[key][i] = token_lists
+
+        self.keys = {k: np.asarray(v, dtype=np.intp) for k, v in keys.items()}
+        self.values = {
+            k: {v: np.asarray(p, dtype=np.intp) for v, p in by_value.items()}
+            for k, by_value in values.items()
+        }
+        self.words = {k: np.asarray(v, dtype=np.intp) for k, v in words.items()}
+
+    def __len__(self):
+        return self.size
+
+    def has(self, key):
+        return self.keys.get(key, _EMPTY)
+
+    def equals(self, key, value):
+        return self.values.get(key, {}).get(value, _EMPTY)
+
+    def contains(self, key, phrase):
+        phrase = _words(phrase)
+        if not phrase:
+            return self.has(key)
+        # самое короткое пересечение - с самого редкого слова
+        postings = sorted((self.words.get((key, w), _EMPTY) for w in set(phrase)), key=len)
+        result = postings[0]
+        for posting in postings[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, posting, assume_unique=True)
+        if len(phrase) > 1 and len(result):
+            texts = self._phrases[key]
+            result = result[[any(_contains(t, phrase) for t in texts[i]) for i in result]]
+        return result
+
+    def compare(self, key, op, target):
+        # число считается один раз на уникальное значение
+        hits = [
+            posting for value, posting in self.values.get(key, {}).items()
+            if (n := _number(value)) is not None and _compare(n, op, target)
+        ]
+        if not hits:
+            return _EMPTY
+        return np.unique(np.concatenate(hits))
+
+    def all(self):
+        return np.arange(self.size, dtype=np.intp)
+
+
+class _Cond:
+    def __init__(self, key, op=None, value=None):
+        self.key = key
+        self.op = op
+        self.value = value
+        if op in ("<", "<=", ">", ">="):
+            self.number = _number(value)
+            if self.number is None:
+                raise QueryError(f"'{key} {op} {value}': нужно число")
+
+    def indices(self, index):
+        op = self.op
+        if op is None:
+            return index.has(self.key)
+        if op == "=":
+            return index.equals(self.key, self.value)
+        if op == "~":
+            return index.contains(self.key, self.value)
+        if op in ("!=", "!~"):
+            positive = index.equals(self.key, self.value) if op == "!=" else index.contains(self.key, self.value)
+            return np.setdiff1d(index.has(self.key), positive, assume_unique=True)
+        return index.compare(self.key, op, self.number)
+
+    def matches(self, fields):
+        values = fields.get(self.key)
+        if not values:
+            return False
+        op = self.op
+        if op is None:
+            return True
+        if op in ("=", "!="):
+            hit = any(self.value in _parts(v) for v in values)
+        elif op in ("~", "!~"):
+            phrase = _words(self.value)
+            hit = any(_contains(_words(v), phrase) for v in values)
+        else:
+            return any(
+                (n := _number(part)) is not None and _compare(n, op, self.number)
+                for v in values for part in _parts(v)
+            )
+        return hit != (op in ("!=", "!~"))
+
+
+class _And:
+    def __init__(self, items):
+        self.items = items
+
+    def indices(self, index):
+        result = None
+        for item in self.items:
+            found = item.indices(index)
+            result = found if result is None else np.intersect1d(result, found, assume_unique=True)
+            if not len(result):
+                break
+        return result
+
+    def matches(self, fields):
+        return all(item.matches(fields) for item in self.items)
+
+
+class _Or:
+    def __init__(self, items):
+        self.items = items
+
+    def indices(self, index):
+        result = self.items[0].indices(index)
+        for item in self.items[1:]:
+            result = np.union1d(result, item.indices(index))
+        return result
+
+    def matches(self, fields):
+        return any(item.matches(fields) for item in self.items)
+
+
+class _Not:
+    def __init__(self, item):
+        self.item = item
+
+    def indices(self, index):
+        return np.setdiff1d(index.all(), self.item.indices(index), assume_unique=True)
+
+    def matches(self, fields):
+        return not self.item.matches(fields)
+
+
+def _tokenize(text):
+    tokens = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        m = _TOKEN_RE.match(text, pos)
+        if not m or m.end() == pos:
+            raise QueryError(f"Не понял запрос с позиции {pos}: {text[pos:]!r}")
+        pos = m.end()
+        op, dq, sq, word = m.groups()
+        if op:
+            tokens.append(("op", op))
+        elif word is not None and word.lower() in _KEYWORDS:
+            tokens.append((word.lower(), word))
+        else:
+            tokens.append(("text", word if word is not None else (dq if dq is not None else sq)))
+    return tokens
+
+
+class _Parser:
+    # or -> and -> not -> условие / скобки
+    def __init__(self, text):
+        self.tokens = _tokenize(text)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise QueryError("Пустой запрос")
+        node = self.parse_or()
+        if self.pos < len(self.tokens):
+            raise QueryError(f"Лишнее в запросе: {self.peek()[1]!r}")
+        return node
+
+    def parse_or(self):
+        items = [self.parse_and()]
+        while self.peek()[0] == "or":
+            self.take()
+            items.append(self.parse_and())
+        return items[0] if len(items) == 1 else _Or(items)
+
+    def parse_and(self):
+        items = [self.parse_not()]
+        while self.peek()[0] == "and":
+            self.take()
+            items.append(self.parse_not())
+        return items[0] if len(items) == 1 else _And(items)
+
+    def parse_not(self):
+        if self.peek()[0] == "not":
+            self.take()
+            return _Not(self.parse_not())
+        if self.peek() == ("op", "("):
+            self.take()
+            node = self.parse_or()
+            if self.take() != ("op", ")"):
+                raise QueryError("Не закрыта скобка")
+            return node
+        return self.parse_cond()
+
+    def words(self):
+        # ключ и значение без кавычек - несколько слов подряд
+        words = []
+        while self.peek()[0] == "text":
+            words.append(self.take()[1])
+        return normalize(" ".join(words))
+
+    def parse_cond(self):
+        key = self.words()
+        if not key:
+            raise QueryError(f"Ожидалась характеристика, а не {self.peek()[1]!r}")
+        kind, op = self.peek()
+        if kind != "op" or op not in OPERATORS:
+            return _Cond(key)
+        self.take()
+        value = self.words()
+        if not value:
+            raise QueryError(f"Нет значения после '{key} {op}'")
+        return _Cond(key, op, value)
+
+
+class Query:
+    """Разобранный запрос: indices(CharIndex) или matches(Product)."""
+
+    def __init__(self, text):
+        self.text = text
+        self._root = _Parser(text).parse()
+
+    def __repr__(self):
+        return f"Query({self.text!r})"
+
+    def indices(self, index):
+        return self._root.indices(index)
+
+    def matches(self, product):
+        return self._root.matches(product_fields(product))
+
+
+def parse_query(*texts):
+    """Query из одного или нескольких выражений (склеиваются через and).
+    Ошибки разбора - QueryError."""
+    texts = [t for t in texts if t and t.strip()]
+    if not texts:
+        return None
+    if len(texts) == 1:
+        return Query(texts[0])
+    return Query(" and ".join(f"({t})" for t in texts))
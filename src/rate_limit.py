@@ -0,0 +1,125 @@
+"""Общий адаптивный лимитер запросов (token bucket на хост + AIMD)."""
+
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+from src.config import (
+    DELAY_ON_ERROR,
+    RATE_BURST,
+    RATE_DECREASE,
+    RATE_INCREASE,
+    RATE_INITIAL,
+    RATE_MAX,
+    RATE_MIN,
+    RATE_TARGET_429,
+    RATE_WINDOW,
+)
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def parse_retry_after(value):
+    """Retry-After бывает в секундах или HTTP-датой."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class _Bucket:
+    def __init__(self, host):
+        self.host = host
+        self.rate = RATE_INITIAL
+        self.tokens = float(RATE_BURST)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.total = 0
+        self.limited = 0
+
+
+class RateLimiter:
+    """Token bucket на каждый хост, общий для всех потоков/корутин.
+
+    Скорость подстраивается сама: каждые RATE_WINDOW ответов смотрим долю
+    429 - если выше RATE_TARGET_429, режем скорость в RATE_DECREASE раз,
+    иначе прибавляем RATE_INCREASE. На 429 хост ставится на паузу целиком
+    (по Retry-After), так что остальные потоки тоже ждут, а не долбят API.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def _bucket(self, host):
+        b = self._buckets.get(host)
+        if b is None:
+            b = self._buckets[host] = _Bucket(host)
+        return b
+
+    def reserve(self, url):
+        """Берём токен и возвращаем сколько надо подождать перед запросом."""
+        host = urlsplit(url).hostname or ""
+        with self._lock:
+            b = self._bucket(host)
+            now = time.monotonic()
+            b.tokens = min(RATE_BURST, b.tokens + (now - b.updated) * b.rate)
+            b.updated = now
+            # токены могут уйти в минус - это очередь ожидающих
+            b.tokens -= 1
+            wait = 0.0 if b.tokens >= 0 else -b.tokens / b.rate
+            return max(wait, b.paused_until - now)
+
+    def acquire(self, url):
+        metrics.sleep(self.reserve(url), "rate_limit")
+
+    async def aacquire(self, url):
+        await metrics.asleep(self.reserve(url), "rate_limit")
+
+    def feedback(self, url, status, retry_after=None):
+        """Сообщаем лимитеру результат запроса."""
+        host = urlsplit(url).hostname or ""
+        with self._lock:
+            b = self._bucket(host)
+            b.total += 1
+            if status == 429:
+                b.limited += 1
+                pause = parse_retry_after(retry_after)
+                if pause is None:
+                    pause = DELAY_ON_ERROR
+                now = time.monotonic()
+                b.paused_until = max(b.paused_until, now + pause)
+                # всё что накопилось в ведре после паузы не нужно
+                b.tokens = min(b.tokens, 0.0)
+                b.updated = now
+
+            if b.total < RATE_WINDOW:
+                return
+
+            ratio = b.limited / b.total
+            old = b.rate
+            if ratio > RATE_TARGET_429:
+                b.rate = max(RATE_MIN, b.rate * RATE_DECREASE)
+            else:
+                b.rate = min(RATE_MAX, b.rate + RATE_INCREASE)
+            b.total = b.limited = 0
+            if b.rate != old:
+                metrics.set("wb_rate_limit_rps", b.rate, host=host)
+                logger.debug(f"{host}: {old:.2f} -> {b.rate:.2f} req/s (429: {ratio:.0%})")
+
+    def rates(self):
+        with self._lock:
+            return {host: b.rate for host, b in self._buckets.items()}
+
+
+# один на процесс - делят все парсеры и воркеры
+limiter = RateLimiter()
@@ -0,0 +1,84 @@
+"""Перефильтрация готовой выгрузки без повторного парсинга.
+
+    python -m src.refilter output/catalog_full_....jsonl --min-rating 4.8 --max-price 5000
+    python -m src.refilter output/catalog_full_....jsonl --where 'Состав ~ "шерсть 100%"'
+"""
+
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+from src.catalog import NUMERIC, Catalog
+from src.config import DEFAULT_FILTER
+from src.main import setup_logging
+from src.query import QueryError, parse_query
+from src.sinks import SINKS, export
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Перефильтрация каталога WB")
+
+    parser.add_argument("input", help="Выгрузка в JSONL (-f jsonl)")
+    parser.add_argument("-o", "--output", help="Куда писать (без расширения)")
+    parser.add_argument("-f", "--format", default="xlsx",
+                        help=f"Форматы через запятую: {', '.join(SINKS)}")
+
+    parser.add_argument("--min-rating", type=float, default=DEFAULT_FILTER["min_rating"])
+    parser.add_argument("--max-price", type=int, default=DEFAULT_FILTER["max_price"])
+    parser.add_argument("--country", default=DEFAULT_FILTER["country"],
+                        help="Страна (пустая строка - не фильтровать)")
+    parser.add_argument("--where", action="append", default=[],
+                        help='Условие по характеристикам, например \'Состав ~ "шерсть 100%%"\' '
+                             '(можно несколько - через and)')
+
+    parser.add_argument("--sort", choices=sorted(NUMERIC) + ["price_rub"],
+                        help="Сортировка")
+    parser.add_argument("--desc", action="store_true", help="По убыванию")
+    parser.add_argument("--top", type=int, help="Только первые N")
+
+    parser.add_argument("-v", "--verbose", action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    setup_logging(args.verbose)
+    logger = logging.getLogger(__name__)
+
+    formats = [f.strip() for f in args.format.split(",") if f.strip()]
+    unknown = [f for f in formats if f not in SINKS]
+    if unknown or not formats:
+        logger.error(f"Неизвестный формат: {', '.join(unknown) or args.format}")
+        return 2
+
+    try:
+        query = parse_query(*args.where)
+    except QueryError as e:
+        logger.error(f"--where: {e}")
+        return 2
+
+    catalog = Catalog.from_jsonl(args.input)
+
+    start = time.perf_counter()
+    selected = catalog.filter(
+        min_rating=args.min_rating,
+        max_price=args.max_price,
+        country=args.country or None,
+    )
+    if query is not None:
+        selected = catalog.where(query, selected)
+    if args.top:
+        selected = catalog.top(args.top, args.sort or "rating", selected, descending=not args.sort or args.desc)
+    elif args.sort:
+        selected = catalog.sort(args.sort, selected, descending=args.desc)
+    logger.info(f"Отобрано {len(selected)} из {len(catalog)} за {(time.perf_counter() - start) * 1000:.1f} мс")
+
+    base = args.output or str(Path(args.input).with_suffix("")) + "_refiltered"
+    export(catalog.take(selected), formats, base, "Отфильтрованные")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
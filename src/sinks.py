@@ -0,0 +1,258 @@
+"""Потоковые выгрузки: xlsx, csv, jsonl, parquet.
+
+Все берут колонки из excel_writer.COLUMNS и пишут построчно, так что
+товары можно отдавать прямо из парсера. JSONL - для машин: списки и
+характеристики в нём как есть, а не склеенной строкой.
+"""
+
+import csv
+import importlib.util
+import json
+import logging
+from contextlib import ExitStack
+from pathlib import Path
+
+from src.config import PARQUET_BATCH_ROWS
+from src.excel_writer import COLUMNS, XlsxBook
+
+logger = logging.getLogger(__name__)
+
+FIELDS = [attr for _, attr, _ in COLUMNS]
+TITLES = [title for title, _, _ in COLUMNS]
+# колонка-строка -> поле Product, которое JSONL пишет без склейки
+STRUCTURED = {
+    "images_str": "images",
+    "image_paths_str": "image_paths",
+    "characteristics_str": "characteristics",
+    "sizes_str": "sizes",
+}
+
+
+def product_row(product):
+    """Значения колонок товара в порядке COLUMNS."""
+    return [getattr(product, attr, "") for attr in FIELDS]
+
+
+class Sink:
+    """Базовая выгрузка: write_row(values, product) на каждый товар, потом
+    close(). values - product_row(product), считается один раз на все
+    выгрузки."""
+
+    ext = ""
+
+    @classmethod
+    def check(cls):
+        """Проверка зависимостей до того, как открыт хоть один файл."""
+
+    def __init__(self, path, title="Товары"):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.title = title
+        self.rows = 0
+
+    def write(self, product):
+        self.write_row(product_row(product), product)
+
+    def write_row(self, values, product):
+        raise NotImplementedError
+
+    def close(self):
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class XlsxSink(Sink):
+    ext = "xlsx"
+
+    def __init__(self, path, title="Товары"):
+        super().__init__(path, title)
+        self._book = XlsxBook(title)
+
+    def write_row(self, values, product):
+        self._book.write_values(values)
+        self.rows += 1
+
+    def close(self):
+        if self._book is not None:
+            self._book.save(self.path)
+            self._book = None
+        return self.path
+
+
+class CsvSink(Sink):
+    """CSV с заголовками как в xlsx; utf-8-sig - чтобы Excel открыл кириллицу."""
+
+    ext = "csv"
+
+    def __init__(self, path, title="Товары"):
+        super().__init__(path, title)
+        self._file = open(self.path, "w", encoding="utf-8-sig", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(TITLES)
+
+    def write_row(self, values, product):
+        self._writer.writerow(values)
+        self.rows += 1
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        return self.path
+
+
+class JsonlSink(Sink):
+    """Объект на строку, ключи - атрибуты из COLUMNS; вместо *_str -
+    сами списки и словарь характеристик (см. STRUCTURED)."""
+
+    ext = "jsonl"
+
+    def __init__(self, path, title="Товары"):
+        super().__init__(path, title)
+        self._file = open(self.path, "w", encoding="utf-8")
+
+    def write_row(self, values, product):
+        record = {}
+        for attr, value in zip(FIELDS, values):
+            name = STRUCTURED.get(attr)
+            if name is None:
+                record[attr] = value
+            else:
+                record[name] = getattr(product, name)
+        self._file.write(json.dumps(record, ensure_ascii=False))
+        self._file.write("\n")
+        self.rows += 1
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        return self.path
+
+
+class ParquetSink(Sink):
+    """Parquet через pyarrow, пишем группами по PARQUET_BATCH_ROWS строк."""
+
+    ext = "parquet"
+
+    NUMERIC = {
+        "article": "int64",
+        "price_rub": "float64",
+        "stock": "int64",
+        "rating": "float64",
+        "feedbacks_count": "int64",
+    }
+
+    @classmethod
+    def check(cls):
+        if importlib.util.find_spec("pyarrow") is None:
+            raise RuntimeError("Для parquet нужен pyarrow: pip install pyarrow")
+
+    def __init__(self, path, title="Товары", batch_rows=PARQUET_BATCH_ROWS):
+        self.check()
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        super().__init__(path, title)
+        self._pa = pa
+        self.batch_rows = batch_rows
+        self._schema = pa.schema([
+            (attr, getattr(pa, self.NUMERIC.get(attr, "string"))()) for attr in FIELDS
+        ])
+        self._writer = pq.ParquetWriter(self.path, self._schema)
+        self._columns = [[] for _ in FIELDS]
+
+    def write_row(self, values, product):
+        for column, value in zip(self._columns, values):
+            column.append(value)
+        self.rows += 1
+        if len(self._columns[0]) >= self.batch_rows:
+            self._flush()
+
+    def _flush(self):
+        if not self._columns[0]:
+            return
+        batch = self._pa.record_batch(self._columns, schema=self._schema)
+        self._writer.write_batch(batch)
+        self._columns = [[] for _ in FIELDS]
+
+    def close(self):
+        if self._writer is not None:
+            self._flush()
+            self._writer.close()
+            self._writer = None
+        return self.path
+
+
+SINKS = {
+    "xlsx": XlsxSink,
+    "csv": CsvSink,
+    "jsonl": JsonlSink,
+    "parquet": ParquetSink,
+}
+
+
+def open_sinks(formats, outputs):
+    """Выгрузки для каждой пары (база пути, заголовок) из outputs во всех
+    форматах. Зависимости проверяются до открытия файлов; если какая-то
+    выгрузка не открылась - уже открытые закрываем."""
+    for f in formats:
+        SINKS[f].check()
+    with ExitStack() as stack:
+        sinks = [
+            stack.enter_context(SINKS[f](f"{base}.{SINKS[f].ext}", title))
+            for base, title in outputs for f in formats
+        ]
+        stack.pop_all()
+    return sinks
+
+
+def export(products, formats, base, title="Товары"):
+    """Одна выгрузка во всех форматах. Возвращает (строк, [пути])."""
+    sinks = open_sinks(formats, [(base, title)])
+    count = 0
+    try:
+        for p in products:
+            row = product_row(p)
+            count += 1
+            for sink in sinks:
+                sink.write_row(row, p)
+    finally:
+        paths = [sink.close() for sink in sinks]
+
+    for path in paths:
+        logger.info(f"Сохранено: {path}")
+    return count, paths
+
+
+def export_all(products, formats, full_base, filtered_base, filter_func):
+    """Полная и отфильтрованная выгрузки во всех форматах за один проход.
+
+    full_base / filtered_base - пути без расширения. Строка товара
+    считается один раз и уходит во все выгрузки.
+    Возвращает (всего, прошло фильтр, [пути файлов]).
+    """
+    sinks = open_sinks(formats, [(full_base, "Товары"), (filtered_base, "Отфильтрованные")])
+    full, filtered = sinks[:len(formats)], sinks[len(formats):]
+
+    total = 0
+    passed = 0
+    try:
+        for p in products:
+            row = product_row(p)
+            total += 1
+            for sink in full:
+                sink.write_row(row, p)
+            if filter_func(p):
+                passed += 1
+                for sink in filtered:
+                    sink.write_row(row, p)
+    finally:
+        paths = [sink.close() for sink in full + filtered]
+
+    for path in paths:
+        logger.info(f"Сохранено: {path}")
+    return total, passed, paths
@@ -0,0 +1,357 @@
+"""Асинхронный HTTP парсер WB (httpx.AsyncClient + HTTP/2)."""
+
+import asyncio
+import logging
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+import httpx
+
+from src.basket import NOT_FOUND, baskets
+from src.cache import cache_ttl, get_cache_entry, get_cache_key, set_cached, touch_cached
+from src.checkpoint import aiter_journaled, first_page
+from src.config import (
+    ASYNC_CONCURRENCY,
+    MAX_PAGES,
+    PIPELINE_BUFFER,
+    REQUEST_TIMEOUT,
+    RETRY_COUNT,
+    RETRY_DELAY,
+    SEARCH_URL,
+    SEARCH_WINDOW,
+    get_headers,
+)
+from src.delta import stale_articles
+from src.metrics import metrics
+from src.payload import loads, prune_payload
+from src.rate_limit import limiter
+from src.wb_parser import WildberriesParser, _resolved
+
+logger = logging.getLogger(__name__)
+
+
+def iter_async(make_agen, maxsize=PIPELINE_BUFFER):
+    """Синхронный генератор поверх async генератора.
+
+    Цикл событий крутится в отдельном потоке, элементы идут через
+    ограниченную очередь - если потребитель не успевает, встаёт и
+    производитель. make_agen вызывается уже внутри цикла.
+    """
+    out = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    end = object()
+    error = []
+
+    def put(item):
+        # блокирующий put с возможностью отмены из генератора
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    async def pump():
+        loop = asyncio.get_running_loop()
+        gen = make_agen()
+        try:
+            async for item in gen:
+                if not await loop.run_in_executor(None, put, item):
+                    break
+        finally:
+            await gen.aclose()
+
+    def run():
+        try:
+            asyncio.run(pump())
+        except BaseException as e:
+            error.append(e)
+        finally:
+            put(end)
+
+    thread = threading.Thread(target=run, name="wb-async", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = out.get()
+            if item is end:
+                break
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+    if error:
+        raise error[0]
+
+
+class AsyncWildberriesParser(WildberriesParser):
+    """То же что WildberriesParser, но search/get_card/enrich - корутины.
+
+    Вместо пула потоков со sleep'ами - один поток и семафор на
+    concurrency одновременных запросов. Разбор ответов берём из
+    родителя, переписана только сетевая часть.
+    """
+
+    def __init__(self, use_cache=True, concurrency=ASYNC_CONCURRENCY, proxy=None,
+                 search_window=SEARCH_WINDOW, delta=None, journal=None):
+        super().__init__(use_cache=use_cache, max_workers=1, proxy=proxy,
+                         search_window=search_window, delta=delta, journal=journal)
+        self.concurrency = concurrency
+        self._aclient = None
+        self._sem = None
+
+    def _new_client(self):
+        # http2 требует пакет h2 (httpx[http2])
+        return httpx.AsyncClient(
+            headers=get_headers(),
+            timeout=REQUEST_TIMEOUT,
+            follow_redirects=True,
+            proxy=self.proxy,
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=self.concurrency,
+                max_keepalive_connections=self.concurrency,
+            ),
+        )
+
+    async def _arequest(self, url, params=None, cache_prefix=None, missing=None):
+        """Асинхронный запрос с ретраями и кэшем. На 404 - missing."""
+        cache_key = None
+        entry = None
+        headers = {}
+        if self.use_cache and cache_prefix:
+            cache_key = get_cache_key(cache_prefix, url, str(sorted(params.items()) if params else ""))
+            # SQLite кэш блокирующий - не в цикле событий
+            entry = await asyncio.to_thread(get_cache_entry, cache_key)
+            if entry and entry.data and entry.fresh:
+                return entry.data
+            # протухло - спрашиваем сервер, изменилось ли
+            if entry and entry.data:
+                if entry.etag:
+                    headers["If-None-Match"] = entry.etag
+                if entry.last_modified:
+                    headers["If-Modified-Since"] = entry.last_modified
+
+        last_err = None
+        for attempt in range(RETRY_COUNT):
+            try:
+                await limiter.aacquire(url)
+                async with self._sem:
+                    self._req_count += 1
+                    started = time.perf_counter()
+                    try:
+                        resp = await self._aclient.get(url, params=params, headers=headers)
+                    except httpx.RequestError:
+                        metrics.request(url, "error", time.perf_counter() - started, attempt)
+                        raise
+                metrics.request(url, resp.status_code, time.perf_counter() - started, attempt)
+                limiter.feedback(url, resp.status_code, resp.headers.get("Retry-After"))
+                if resp.status_code == 304 and entry:
+                    await asyncio.to_thread(touch_cached, cache_key, cache_ttl(cache_prefix))
+                    return entry.data
+                resp.raise_for_status()
+                data = prune_payload(cache_prefix, loads(resp.content))
+
+                if cache_key and data:
+                    await asyncio.to_thread(
+                        set_cached, cache_key, data,
+                        ttl=cache_ttl(cache_prefix),
+                        etag=resp.headers.get("ETag"),
+                        last_modified=resp.headers.get("Last-Modified"),
+                    )
+                return data
+
+            except httpx.HTTPStatusError as e:
+                last_err = e
+                code = e.response.status_code
+
+                if code == 429:
+                    logger.warning("429 Too Many Requests, хост на паузе")
+                elif code == 404:
+                    return missing
+                elif code >= 500:
+                    await metrics.asleep(RETRY_DELAY * (attempt + 1), "retry")
+                else:
+                    logger.error(f"HTTP {code}: {url[:50]}...")
+                    return None
+
+            except httpx.TimeoutException:
+                last_err = "timeout"
+                await metrics.asleep(RETRY_DELAY * (attempt + 1), "retry")
+            except httpx.RequestError as e:
+                last_err = e
+                await metrics.asleep(RETRY_DELAY * (attempt + 1), "retry")
+
+        logger.error(f"Все попытки провалились: {last_err}")
+        return None
+
+    async def _asearch_page(self, query, page):
+        params = self._search_params(query, page)
+        data = await self._arequest(SEARCH_URL, params, cache_prefix=f"search_{query}")
+        if not data:
+            return None
+        return data.get("data", {}).get("products", [])
+
+    async def aiter_search(self, query, max_pages=None):
+        """Поиск товаров, постранично - окно из search_window страниц,
+        отдаём по порядку, на пустой странице отменяем остальные."""
+        pages = max_pages or MAX_PAGES
+        async for page_products in aiter_journaled(self.journal, self._aiter_pages(query, pages), pages):
+            yield page_products
+
+    async def _aiter_pages(self, query, pages):
+        # (номер, товары) как WildberriesParser._iter_pages
+        window = max(1, self.search_window)
+
+        await metrics.asleep(random.uniform(1.0, 2.0), "jitter")
+
+        pending = deque()
+        next_page = first_page(self.journal)
+        try:
+            while True:
+                while next_page <= pages and len(pending) < window:
+                    task = asyncio.ensure_future(self._asearch_page(query, next_page))
+                    pending.append((next_page, task))
+                    next_page += 1
+                if not pending:
+                    break
+
+                page, task = pending.popleft()
+                items = await task
+                if items is None:
+                    logger.warning(f"Страница {page} не загружена")
+                    break
+                if not items:
+                    logger.info("Пусто, конец")
+                    yield page, []
+                    break
+
+                logger.info(f"Страница {page}/{pages}: {len(items)}")
+                yield page, [self._product_from_item(item) for item in items]
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    async def search(self, query, max_pages=None):
+        """Поиск товаров."""
+        products = []
+        async for page_products in self.aiter_search(query, max_pages):
+            products.extend(page_products)
+        return products
+
+    async def _astatus(self, url):
+        await limiter.aacquire(url)
+        started = time.perf_counter()
+        try:
+            async with self._sem:
+                resp = await self._aclient.head(url)
+        except httpx.RequestError:
+            metrics.request(url, "error", time.perf_counter() - started)
+            return 0
+        metrics.request(url, resp.status_code, time.perf_counter() - started)
+        limiter.feedback(url, resp.status_code, resp.headers.get("Retry-After"))
+        return resp.status_code
+
+    async def get_card(self, article):
+        """Карточка товара."""
+        basket = baskets.for_article(article)
+        card = await self._arequest(self._card_url(article, basket), cache_prefix=f"card_{article}",
+                                    missing=NOT_FOUND)
+        if card is NOT_FOUND:
+            # 404 - скорее всего не тот basket, ищем у соседей
+            card = None
+            found = await baskets.adiscover(article, basket, self._astatus)
+            if found is not None:
+                card = await self._arequest(self._card_url(article, found), cache_prefix=f"card_{article}")
+        return card or {}
+
+    async def enrich(self, product):
+        """Обогащаем данные."""
+        card = await self.get_card(product.article)
+        if card:
+            self._apply_card(product, card)
+        return product
+
+    async def _enrich_safe(self, product):
+        try:
+            await self.enrich(product)
+        except Exception as e:
+            logger.error(f"Ошибка {product.article}: {e}")
+        return product
+
+    async def aiter_parse(self, query, max_pages=None, enrich=True):
+        """Поиск и обогащение конвейером (async генератор).
+
+        Как WildberriesParser.iter_parse: задачи на обогащение стартуют
+        сразу по приходу страницы, отдаём по порядку, в работе не больше
+        PIPELINE_BUFFER товаров.
+        """
+        async for _, p in self.aiter_parse_batch([query], max_pages, enrich):
+            yield p
+
+    async def aiter_parse_batch(self, queries, max_pages=None, enrich=True):
+        """(запрос, товар) по всем запросам на одном клиенте."""
+        self._sem = asyncio.Semaphore(self.concurrency)
+        self._aclient = self._new_client()
+        try:
+            for query in queries:
+                async for p in self._aiter_query(query, max_pages, enrich):
+                    yield query, p
+        finally:
+            await self._aclient.aclose()
+            self._aclient = None
+
+    async def _aiter_query(self, query, max_pages, enrich):
+        pending = deque()
+        count = 0
+
+        def counted(p):
+            # как take в WildberriesParser.iter_parse - лог раз в 20 товаров
+            nonlocal count
+            count += 1
+            if count % 20 == 0:
+                logger.info(f"Обогащено {count}")
+            return p
+
+        try:
+            async for page_products in self.aiter_search(query, max_pages):
+                if not enrich:
+                    for p in page_products:
+                        yield p
+                    continue
+                stale = stale_articles(page_products, self.articles, self.journal, self.delta)
+                for p in page_products:
+                    if p.article in stale:
+                        pending.append(asyncio.ensure_future(self._enrich_safe(p)))
+                    else:
+                        pending.append(asyncio.wrap_future(_resolved(p)))
+                    while len(pending) >= PIPELINE_BUFFER:
+                        yield counted(await pending.popleft())
+                while pending and pending[0].done():
+                    yield counted(pending.popleft().result())
+            while pending:
+                yield counted(await pending.popleft())
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def aparse_all(self, query, max_pages=None, enrich=True):
+        """Полный парсинг (корутина)."""
+        products = [p async for p in self.aiter_parse(query, max_pages, enrich)]
+        logger.info(f"Готово: {len(products)}")
+        return products
+
+    def iter_parse(self, query, max_pages=None, enrich=True, parallel=True):
+        """Синхронный генератор поверх aiter_parse для экспорта из main."""
+        return iter_async(lambda: self.aiter_parse(query, max_pages, enrich))
+
+    def iter_parse_batch(self, queries, max_pages=None, enrich=True, parallel=True):
+        return iter_async(lambda: self.aiter_parse_batch(queries, max_pages, enrich))
+
+    def parse_all(self, query, max_pages=None, enrich=True, parallel=True):
+        """Синхронная обёртка, чтобы main мог звать как обычный парсер."""
+        return asyncio.run(self.aparse_all(query, max_pages, enrich))
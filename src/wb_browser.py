@@ -3,28 +3,67 @@
 import logging
 import random
 import time
-from urllib.parse import quote
+from urllib.parse import quote, urlsplit
 
-from src.cache import get_cache_key, get_cached, set_cached
+from src.basket import baskets, card_url, image_urls
+from src.cache import cache_ttl, get_cache_key, get_cached, set_cached
+from src.checkpoint import first_page, iter_journaled
 from src.config import (
-    DELAY_BETWEEN_PAGES,
-    DELAY_BETWEEN_PRODUCTS,
+    BLOCK_DOMAINS,
+    BLOCK_RESOURCE_TYPES,
+    BLOCK_RESOURCES,
     DETAIL_API_URL,
+    DETAIL_BATCH_SIZE,
     MAX_PAGES,
     PRODUCT_URL,
+    SEARCH_API_TIMEOUT,
     SELLER_URL,
 )
-from src.models import Product
+from src.delta import stale_articles
+from src.metrics import metrics
+from src.models import Product, intern_str
+from src.payload import loads, prune_payload
+from src.rate_limit import limiter
 
 logger = logging.getLogger(__name__)
 
 
+LAUNCH_ARGS = ["--disable-blink-features=AutomationControlled", "--no-sandbox"]
+CONTEXT_OPTIONS = {
+    "viewport": {"width": 1920, "height": 1080},
+    "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36",
+    "locale": "ru-RU",
+}
+INIT_SCRIPT = "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
+
+
+def should_block(url, resource_type):
+    """Картинки, шрифты, видео и трекеры браузеру не нужны."""
+    if resource_type in BLOCK_RESOURCE_TYPES:
+        return True
+    host = urlsplit(url).hostname or ""
+    return any(host == d or host.endswith("." + d) for d in BLOCK_DOMAINS)
+
+
+def is_search_api(response):
+    return "search.wb.ru" in response.url and "search" in response.url
+
+
 class WBBrowserParser:
     """Парсер через браузер - обходит блокировки."""
     
-    def __init__(self, use_cache=True, headless=True):
+    def __init__(self, use_cache=True, headless=True, block_resources=BLOCK_RESOURCES, delta=None,
+                 journal=None):
         self.use_cache = use_cache
         self.headless = headless
+        self.block_resources = block_resources
+        # DeltaStore (src/delta.py) - обогащать только новое и изменившееся
+        self.delta = delta
+        # RunJournal (src/checkpoint.py) - страницы и товары для --resume
+        self.journal = journal
+        # ArticleMap (src/batch.py) - товары из прошлых запросов пакета
+        self.articles = None
+        self._home_ready = False
         self._pw = None
         self._browser = None
         self._page = None
@@ -42,25 +81,30 @@ class WBBrowserParser:
         
         logger.info("Запуск браузера...")
         self._pw = sync_playwright().start()
-        self._browser = self._pw.chromium.launch(
-            headless=self.headless,
-            args=["--disable-blink-features=AutomationControlled", "--no-sandbox"]
-        )
-        ctx = self._browser.new_context(
-            viewport={"width": 1920, "height": 1080},
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0.0.0 Safari/537.36",
-            locale="ru-RU",
-        )
+        self._browser = self._pw.chromium.launch(headless=self.headless, args=LAUNCH_ARGS)
+        ctx = self._browser.new_context(**CONTEXT_OPTIONS)
+        if self.block_resources:
+            ctx.route("**/*", self._route_filter)
         self._page = ctx.new_page()
         
         self._page.on("response", self._on_response)
         
-        self._page.add_init_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+        self._page.add_init_script(INIT_SCRIPT)
+
+    def _route_filter(self, route):
+        req = route.request
+        if should_block(req.url, req.resource_type):
+            route.abort()
+        else:
+            route.continue_()
 
     def _on_response(self, response):
-        if "search.wb.ru" in response.url and "search" in response.url:
+        if is_search_api(response):
+            # запрос шлёт сама страница - время не меряем, только код
+            metrics.inc("wb_requests_total", endpoint="search", status=str(response.status))
+            limiter.feedback(response.url, response.status, response.headers.get("retry-after"))
             try:
-                self._api_data["search"] = response.json()
+                self._api_data["search"] = loads(response.body())
             except Exception:
                 pass
 
@@ -72,55 +116,28 @@ class WBBrowserParser:
         logger.info("Браузер закрыт")
 
     def _sleep(self, sec):
-        time.sleep(sec + random.uniform(-0.3, 0.5))
-
-    def _get_basket(self, vol):
-        # TODO: может стоит вынести в конфиг, но пока работает так
-        if vol <= 143:
-            return "01"
-        elif vol <= 287:
-            return "02"
-        elif vol <= 431:
-            return "03"
-        elif vol <= 719:
-            return "04"
-        elif vol <= 1007:
-            return "05"
-        elif vol <= 1061:
-            return "06"
-        elif vol <= 1115:
-            return "07"
-        elif vol <= 1169:
-            return "08"
-        elif vol <= 1313:
-            return "09"
-        elif vol <= 1601:
-            return "10"
-        elif vol <= 1655:
-            return "11"
-        elif vol <= 1919:
-            return "12"
-        elif vol <= 2045:
-            return "13"
-        elif vol <= 2189:
-            return "14"
-        elif vol <= 2405:
-            return "15"
-        elif vol <= 2621:
-            return "16"
-        else:
-            return "17"
-
-    def _get_images(self, article, count=10):
-        vol = article // 100000
-        part = article // 1000
-        basket = self._get_basket(vol)
-        base = f"https://basket-{basket}.wbbasket.ru/vol{vol}/part{part}/{article}/images/big"
-        # генерим URL'ы, обычно их не больше 10, но на всякий случай
-        images = []
-        for i in range(1, count + 1):
-            images.append(f"{base}/{i}.webp")
-        return images
+        metrics.sleep(sec + random.uniform(-0.3, 0.5), "browser")
+
+    def _api_get(self, url):
+        # запросы из контекста браузера тоже через общий лимитер
+        limiter.acquire(url)
+        started = time.perf_counter()
+        resp = self._page.request.get(url)
+        metrics.request(url, resp.status, time.perf_counter() - started)
+        limiter.feedback(url, resp.status, resp.headers.get("retry-after"))
+        return resp
+
+    def _status(self, url):
+        # проба хоста basket - только код ответа
+        limiter.acquire(url)
+        started = time.perf_counter()
+        resp = self._page.request.head(url)
+        metrics.request(url, resp.status, time.perf_counter() - started)
+        limiter.feedback(url, resp.status, resp.headers.get("retry-after"))
+        return resp.status
+
+    def _get_images(self, article, count=None):
+        return image_urls(article, count)
 
     def _parse_sizes(self, sizes_data):
         """Парсим размеры и остатки."""
@@ -156,7 +173,7 @@ class WBBrowserParser:
             article=article,
             name=item.get("name", ""),
             price=price,
-            images=self._get_images(article),
+            images=self._get_images(article, item.get("pics")),
             seller_name=item.get("supplier", ""),
             seller_url=SELLER_URL.format(seller_id=seller_id) if seller_id else "",
             sizes=sizes,
@@ -204,13 +221,10 @@ class WBBrowserParser:
             logger.debug(f"HTML parse error: {e}")
             return None
 
-    def search(self, query, max_pages=None):
-        """Ищем товары."""
-        pages = max_pages or MAX_PAGES
-        products = []
-        
+    def _open_home(self):
         logger.info("Загрузка главной...")
-        self._page.goto("https://www.wildberries.ru/", wait_until="networkidle", timeout=60000)
+        # networkidle не ждём - трекеры и баннеры не дают ему наступить
+        self._page.goto("https://www.wildberries.ru/", wait_until="domcontentloaded", timeout=60000)
         self._sleep(3)
         
         # закрываем попапы если есть (иногда мешают)
@@ -221,18 +235,65 @@ class WBBrowserParser:
                 self._sleep(0.5)  # на всякий случай ждём
         except Exception:
             pass  # если нет попапа - ок
+        self._home_ready = True
+
+    def export_session(self):
+        """Открываем главную и отдаём то, что нужно httpx: куки и заголовки.
+
+        Браузер нужен только чтобы пройти антибот, дальше сессию можно
+        использовать из обычного HTTP клиента.
+        """
+        self._open_home()
+        return {
+            "cookies": self._page.context.cookies(),
+            "user_agent": self._page.evaluate("navigator.userAgent"),
+            "accept_language": self._page.evaluate("navigator.languages.join(',')"),
+        }
+
+    def _search_url(self, query, page):
+        return f"https://www.wildberries.ru/catalog/0/search.aspx?search={quote(query)}&page={page}"
+
+    def _goto_search(self, url):
+        """Переходим на страницу поиска и ждём только ответ search.wb.ru."""
+        from playwright.sync_api import TimeoutError as PlaywrightTimeout
+        
+        try:
+            with self._page.expect_response(is_search_api, timeout=SEARCH_API_TIMEOUT * 1000) as info:
+                self._page.goto(url, wait_until="commit", timeout=45000)
+        except PlaywrightTimeout:
+            logger.debug("Ответ поиска не дождались")
+            return
+        try:
+            self._api_data["search"] = loads(info.value.body())
+        except Exception:
+            pass  # может уже разобрал _on_response
+
+    def iter_search(self, query, max_pages=None):
+        """Ищем товары - отдаём постранично, по мере загрузки.
         
-        for page in range(1, pages + 1):
+        С журналом (src/checkpoint.py) записанные страницы не грузятся.
+        """
+        pages = max_pages or MAX_PAGES
+        
+        # в пакетном режиме главная грузится один раз на браузер
+        if not self._home_ready:
+            self._open_home()
+        
+        yield from iter_journaled(self.journal, self._iter_pages(query, pages), pages)
+
+    def _iter_pages(self, query, pages):
+        # (номер, товары) с первой незаписанной страницы, [] - выдача кончилась
+        for page in range(first_page(self.journal), pages + 1):
             logger.info(f"Страница {page}/{pages}...")
             
-            url = f"https://www.wildberries.ru/catalog/0/search.aspx?search={quote(query)}&page={page}"
+            url = self._search_url(query, page)
             self._api_data.clear()
             
             ok = False
             for attempt in range(3):
                 try:
-                    self._page.goto(url, wait_until="load", timeout=45000)
-                    self._sleep(3)
+                    limiter.acquire(url)
+                    self._goto_search(url)
                     
                     if "search" in self._page.url or "catalog" in self._page.url:
                         ok = True
@@ -247,20 +308,24 @@ class WBBrowserParser:
                 logger.warning(f"Страница {page} не загружена")
                 continue
             
-            try:
-                self._page.wait_for_selector("article.product-card", timeout=10000)
-            except Exception:
-                pass
-            
-            self._page.evaluate("window.scrollTo(0, document.body.scrollHeight / 2)")
-            self._sleep(2)
+            if "search" not in self._api_data:
+                # API не поймали - ждём отрисовки карточек для HTML
+                try:
+                    self._page.wait_for_selector("article.product-card", timeout=10000)
+                except Exception:
+                    pass
+                
+                self._page.evaluate("window.scrollTo(0, document.body.scrollHeight / 2)")
+                self._sleep(2)
             
             # пробуем сначала API, если не сработало - HTML
+            products = []
             if "search" in self._api_data:
                 data = self._api_data["search"]
                 items = data.get("data", {}).get("products", [])
                 if not items:
                     logger.info("Пусто, конец")
+                    yield page, []
                     break
                 logger.info(f"API: {len(items)} товаров")
                 for item in items:
@@ -278,32 +343,70 @@ class WBBrowserParser:
                         products.append(p)
                 logger.info(f"HTML: {len(cards)} товаров")
             
-            if page < pages:
-                self._sleep(DELAY_BETWEEN_PAGES)
-        
+            yield page, products
+
+    def search(self, query, max_pages=None):
+        """Ищем товары."""
+        products = []
+        for page_products in self.iter_search(query, max_pages):
+            products.extend(page_products)
         return products
 
+    def _split_cached_details(self, articles):
+        # что есть в кэше - сразу в результат, остальное докачиваем
+        result = {}
+        missing = []
+        for article in articles:
+            if self.use_cache:
+                cached = get_cached(get_cache_key("detail", article))
+                if cached:
+                    result[article] = cached
+                    continue
+            if article not in missing:
+                missing.append(article)
+        batches = [missing[i:i + DETAIL_BATCH_SIZE] for i in range(0, len(missing), DETAIL_BATCH_SIZE)]
+        return result, batches
+
+    def _detail_url(self, batch):
+        nm = ";".join(str(a) for a in batch)
+        return f"{DETAIL_API_URL}?appType=1&curr=rub&dest=-1257786&spp=30&nm={nm}"
+
+    def _store_details(self, batch, items, result):
+        for item in items:
+            article = item.get("id")
+            if article not in batch:
+                continue
+            item = prune_payload("detail", item)
+            result[article] = item
+            if self.use_cache:
+                set_cached(get_cache_key("detail", article), item, ttl=cache_ttl("detail"))
+
+    def get_details(self, articles):
+        """Детали пачкой: card.wb.ru принимает много nm через ';'.
+
+        Возвращаем {article: detail}, каждый товар кладём в кэш отдельно.
+        """
+        result, batches = self._split_cached_details(articles)
+        
+        for batch in batches:
+            try:
+                resp = self._api_get(self._detail_url(batch))
+                if not resp.ok:
+                    continue
+                items = loads(resp.body()).get("data", {}).get("products", [])
+            except Exception as e:
+                logger.debug(f"Detail error {batch[0]}..{batch[-1]}: {e}")
+                continue
+            self._store_details(batch, items, result)
+        
+        return result
+
     def get_detail(self, article):
         """Получаем детали товара (размеры, продавец)."""
-        key = get_cache_key("detail", article)
-        if self.use_cache:
-            cached = get_cached(key)
-            if cached:
-                return cached
-        
-        url = f"{DETAIL_API_URL}?appType=1&curr=rub&dest=-1257786&spp=30&nm={article}"
-        try:
-            resp = self._page.request.get(url)
-            if resp.ok:
-                data = resp.json()
-                items = data.get("data", {}).get("products", [])
-                if items:
-                    if self.use_cache:
-                        set_cached(key, items[0])
-                    return items[0]
-        except Exception as e:
-            logger.debug(f"Detail error {article}: {e}")
-        return {}
+        return self.get_details([article]).get(article, {})
+
+    def _card_url(self, article, basket=None):
+        return card_url(article, basket)
 
     def get_card(self, article):
         """Получаем карточку (описание, характеристики)."""
@@ -313,91 +416,123 @@ class WBBrowserParser:
             if cached:
                 return cached
         
-        vol = article // 100000
-        part = article // 1000
-        basket = self._get_basket(vol)
-        url = f"https://basket-{basket}.wbbasket.ru/vol{vol}/part{part}/{article}/info/ru/card.json"
-        
+        basket = baskets.for_article(article)
         try:
-            resp = self._page.request.get(url)
+            resp = self._api_get(self._card_url(article, basket))
+            if resp.status == 404:
+                # скорее всего не тот basket - ищем у соседей
+                found = baskets.discover(article, basket, self._status)
+                if found is not None:
+                    resp = self._api_get(self._card_url(article, found))
             if resp.ok:
-                data = resp.json()
+                data = prune_payload("card", loads(resp.body()))
                 if self.use_cache:
-                    set_cached(key, data)
+                    set_cached(key, data, ttl=cache_ttl("card"))
                 return data
         except Exception as e:
             logger.debug(f"Card error {article}: {e}")
         return {}
 
-    def enrich(self, product):
-        """Дополняем продукт данными."""
+    def _apply_detail(self, product, detail):
+        seller_id = detail.get("supplierId", 0)
+        product.seller_name = intern_str(detail.get("supplier", ""))
+        # формируем ссылку на продавца
+        if seller_id:
+            product.seller_url = SELLER_URL.format(seller_id=seller_id)
+        else:
+            product.seller_url = ""
+        
+        sizes_data = detail.get("sizes", [])
+        product.sizes, product.stock = self._parse_sizes(sizes_data)
+        
+        # если цены не было, берём из деталей
+        if not product.price and sizes_data:
+            price_info = sizes_data[0].get("price", {})
+            product.price = price_info.get("product", 0)
+        
+        # обновляем рейтинг и отзывы если есть
+        new_rating = detail.get("reviewRating")
+        if new_rating:
+            product.rating = new_rating
+        new_feedbacks = detail.get("feedbacks")
+        if new_feedbacks:
+            product.feedbacks_count = new_feedbacks
+        
+        # точное число фото вместо 10 наугад
+        pics = detail.get("pics")
+        if pics:
+            product.images = self._get_images(product.article, pics)
+
+    def _apply_card(self, product, card):
+        product.description = card.get("description", "")
+        
+        # парсим характеристики
+        options = card.get("options", [])
+        for opt in options:
+            name = opt.get("name", "")
+            value = opt.get("value", "")
+            if name and value:
+                product.characteristics[intern_str(name)] = value
+                # ищем страну в названии характеристики
+                if "страна" in name.lower():
+                    product.country = intern_str(value)
+        
+        photos = card.get("media", {}).get("photo_count")
+        if photos:
+            product.images = self._get_images(product.article, photos)
+        
+        # состав отдельно
+        comps = card.get("compositions", [])
+        if comps:
+            comp_parts = []
+            for c in comps:
+                if c.get("name"):
+                    comp_parts.append(f"{c['name']}: {c['value']}")
+            if comp_parts:
+                product.characteristics["Состав"] = "; ".join(comp_parts)
+
+    def enrich(self, product, detail=None):
+        """Дополняем продукт данными.
+
+        detail можно передать заранее (из get_details), иначе запросим.
+        """
         # сначала детали (размеры, продавец)
-        detail = self.get_detail(product.article)
+        if detail is None:
+            detail = self.get_detail(product.article)
         if detail:
-            seller_id = detail.get("supplierId", 0)
-            product.seller_name = detail.get("supplier", "")
-            # формируем ссылку на продавца
-            if seller_id:
-                product.seller_url = SELLER_URL.format(seller_id=seller_id)
-            else:
-                product.seller_url = ""
-            
-            sizes_data = detail.get("sizes", [])
-            product.sizes, product.stock = self._parse_sizes(sizes_data)
-            
-            # если цены не было, берём из деталей
-            if not product.price and sizes_data:
-                price_info = sizes_data[0].get("price", {})
-                product.price = price_info.get("product", 0)
-            
-            # обновляем рейтинг и отзывы если есть
-            new_rating = detail.get("reviewRating")
-            if new_rating:
-                product.rating = new_rating
-            new_feedbacks = detail.get("feedbacks")
-            if new_feedbacks:
-                product.feedbacks_count = new_feedbacks
+            self._apply_detail(product, detail)
         
         # потом карточка (описание, характеристики)
         card = self.get_card(product.article)
         if card:
-            product.description = card.get("description", "")
-            
-            # парсим характеристики
-            options = card.get("options", [])
-            for opt in options:
-                name = opt.get("name", "")
-                value = opt.get("value", "")
-                if name and value:
-                    product.characteristics[name] = value
-                    # ищем страну в названии характеристики
-                    if "страна" in name.lower():
-                        product.country = value
-            
-            # состав отдельно
-            comps = card.get("compositions", [])
-            if comps:
-                comp_parts = []
-                for c in comps:
-                    if c.get("name"):
-                        comp_parts.append(f"{c['name']}: {c['value']}")
-                if comp_parts:
-                    product.characteristics["Состав"] = "; ".join(comp_parts)
+            self._apply_card(product, card)
         
         return product
 
+    def iter_parse(self, query, max_pages=None, enrich=True):
+        """Поиск и обогащение конвейером - товары отдаются сразу после
+        обогащения, не дожидаясь конца поиска."""
+        count = 0
+        for page_products in self.iter_search(query, max_pages):
+            stale = stale_articles(page_products, self.articles, self.journal, self.delta) if enrich else ()
+            # детали всей страницы одним-двумя запросами
+            details = self.get_details([p.article for p in page_products if p.article in stale])
+            for p in page_products:
+                if p.article in stale:
+                    self.enrich(p, details.get(p.article, {}))
+                    count += 1
+                    if count % 20 == 0:
+                        logger.info(f"Обогащено {count}")
+                yield p
+
+    def iter_parse_batch(self, queries, max_pages=None, enrich=True, parallel=True):
+        """(запрос, товар) по всем запросам в одном браузере."""
+        for query in queries:
+            for p in self.iter_parse(query, max_pages, enrich):
+                yield query, p
+
     def parse(self, query, max_pages=None, enrich=True):
         """Основной метод парсинга."""
-        products = self.search(query, max_pages)
-        logger.info(f"Найдено: {len(products)}")
-        
-        if enrich and products:
-            logger.info("Обогащение данных...")
-            for i, p in enumerate(products, 1):
-                self.enrich(p)
-                if i % 20 == 0:
-                    logger.info(f"Обогащено {i}/{len(products)}")
-                self._sleep(DELAY_BETWEEN_PRODUCTS)
-        
+        products = list(self.iter_parse(query, max_pages, enrich))
         logger.info(f"Готово: {len(products)} товаров")
         return products
@@ -0,0 +1,404 @@
+"""Асинхронный браузерный парсер WB - пул страниц Playwright."""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from src.basket import NOT_FOUND, baskets
+from src.cache import cache_ttl, get_cache_key, get_cached, set_cached
+from src.checkpoint import aiter_journaled, first_page
+from src.config import (
+    BLOCK_RESOURCES,
+    BROWSER_POOL_SIZE,
+    MAX_PAGES,
+    PIPELINE_BUFFER,
+    PRODUCT_URL,
+    SEARCH_API_TIMEOUT,
+)
+from src.delta import stale_articles
+from src.metrics import metrics
+from src.models import Product
+from src.payload import loads, prune_payload
+from src.rate_limit import limiter
+from src.wb_async import iter_async
+from src.wb_browser import (
+    CONTEXT_OPTIONS,
+    INIT_SCRIPT,
+    LAUNCH_ARGS,
+    WBBrowserParser,
+    is_search_api,
+    should_block,
+)
+from src.wb_parser import _resolved
+
+logger = logging.getLogger(__name__)
+
+# достаём карточки из выдачи одним evaluate, без хендлов на каждый элемент
+_HTML_CARDS_JS = """
+cards => cards.map(card => {
+    const text = sel => {
+        const el = card.querySelector(sel);
+        return el ? el.innerText.trim() : "";
+    };
+    return {
+        id: card.getAttribute("data-nm-id"),
+        name: text(".product-card__name"),
+        brand: text(".product-card__brand"),
+        price: text(".price__lower-price"),
+        rating: text(".address-rate-mini"),
+    };
+})
+"""
+
+
+class AsyncWBBrowserParser(WBBrowserParser):
+    """Браузерный парсер на async Playwright.
+
+    Один Chromium, pool_size контекстов по странице в каждом. Поиск
+    идёт на первой странице, а запросы detail/card разбираются
+    страницами пула параллельно. Разбор ответов - из WBBrowserParser.
+    """
+
+    def __init__(self, use_cache=True, headless=True, pool_size=BROWSER_POOL_SIZE,
+                 block_resources=BLOCK_RESOURCES, delta=None, journal=None):
+        super().__init__(use_cache=use_cache, headless=headless, block_resources=block_resources,
+                         delta=delta, journal=journal)
+        self.pool_size = pool_size
+        self._pages = []
+        self._pool = None
+
+    def __enter__(self):
+        # браузер живёт в цикле событий, поднимаем его в aiter_parse
+        return self
+
+    def close(self):
+        pass
+
+    async def _astart(self):
+        from playwright.async_api import async_playwright
+
+        logger.info(f"Запуск браузера (страниц: {self.pool_size})...")
+        self._pw = await async_playwright().start()
+        self._browser = await self._pw.chromium.launch(headless=self.headless, args=LAUNCH_ARGS)
+
+        self._pool = asyncio.Queue()
+        self._pages = []
+        for _ in range(max(1, self.pool_size)):
+            ctx = await self._browser.new_context(**CONTEXT_OPTIONS)
+            if self.block_resources:
+                await ctx.route("**/*", self._aroute_filter)
+            page = await ctx.new_page()
+            await page.add_init_script(INIT_SCRIPT)
+            self._pages.append(page)
+            self._pool.put_nowait(page)
+
+        self._page = self._pages[0]
+        self._page.on("response", self._aon_response)
+        self._home_ready = False
+
+    async def _aclose(self):
+        if self._browser:
+            await self._browser.close()
+        if self._pw:
+            await self._pw.stop()
+        self._browser = self._pw = None
+        logger.info("Браузер закрыт")
+
+    async def _aroute_filter(self, route):
+        req = route.request
+        if should_block(req.url, req.resource_type):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def _aon_response(self, response):
+        if is_search_api(response):
+            metrics.inc("wb_requests_total", endpoint="search", status=str(response.status))
+            limiter.feedback(response.url, response.status, response.headers.get("retry-after"))
+            try:
+                self._api_data["search"] = loads(await response.body())
+            except Exception:
+                pass
+
+    async def _asleep(self, sec):
+        await metrics.asleep(sec + random.uniform(-0.3, 0.5), "browser")
+
+    @asynccontextmanager
+    async def _lease(self):
+        # свободная страница из пула - это и есть ограничение параллельности
+        page = await self._pool.get()
+        try:
+            yield page
+        finally:
+            self._pool.put_nowait(page)
+
+    async def _aapi_get(self, url, missing=None):
+        # не ok - None, 404 - missing
+        await limiter.aacquire(url)
+        async with self._lease() as page:
+            started = time.perf_counter()
+            resp = await page.request.get(url)
+            if resp.ok:
+                data = loads(await resp.body())
+            else:
+                data = missing if resp.status == 404 else None
+            metrics.request(url, resp.status, time.perf_counter() - started)
+        limiter.feedback(url, resp.status, resp.headers.get("retry-after"))
+        return data
+
+    async def _astatus(self, url):
+        # проба хоста basket - только код ответа
+        await limiter.aacquire(url)
+        async with self._lease() as page:
+            started = time.perf_counter()
+            resp = await page.request.head(url)
+            metrics.request(url, resp.status, time.perf_counter() - started)
+        limiter.feedback(url, resp.status, resp.headers.get("retry-after"))
+        return resp.status
+
+    def _product_from_html_data(self, d):
+        try:
+            article = int(d.get("id") or 0)
+        except ValueError:
+            return None
+        if not article:
+            return None
+
+        digits = "".join(c for c in d.get("price") or "" if c.isdigit())
+        try:
+            rating = float((d.get("rating") or "0").replace(",", "."))
+        except ValueError:
+            rating = 0.0
+
+        brand, name = d.get("brand", ""), d.get("name", "")
+        return Product(
+            url=PRODUCT_URL.format(article=article),
+            article=article,
+            name=f"{brand} / {name}" if brand else name,
+            price=int(digits or 0) * 100,
+            images=self._get_images(article),
+            brand=brand,
+            rating=rating,
+        )
+
+    async def _agoto_search(self, url):
+        """Переход на страницу поиска, ждём только ответ search.wb.ru."""
+        from playwright.async_api import TimeoutError as PlaywrightTimeout
+
+        try:
+            async with self._page.expect_response(is_search_api, timeout=SEARCH_API_TIMEOUT * 1000) as info:
+                await self._page.goto(url, wait_until="commit", timeout=45000)
+            response = await info.value
+        except PlaywrightTimeout:
+            logger.debug("Ответ поиска не дождались")
+            return
+        try:
+            self._api_data["search"] = loads(await response.body())
+        except Exception:
+            pass
+
+    async def aiter_search(self, query, max_pages=None):
+        """Ищем товары - постранично, как WBBrowserParser.iter_search."""
+        pages = max_pages or MAX_PAGES
+        if not self._home_ready:
+            await self._aopen_home()
+
+        async for page_products in aiter_journaled(self.journal, self._aiter_pages(query, pages), pages):
+            yield page_products
+
+    async def _aopen_home(self):
+        page_obj = self._page
+        logger.info("Загрузка главной...")
+        await page_obj.goto("https://www.wildberries.ru/", wait_until="domcontentloaded", timeout=60000)
+        await self._asleep(3)
+
+        try:
+            btn = await page_obj.query_selector("[class*='close']")
+            if btn:
+                await btn.click()
+                await self._asleep(0.5)
+        except Exception:
+            pass
+        self._home_ready = True
+
+    async def _aiter_pages(self, query, pages):
+        # (номер, товары) как WBBrowserParser._iter_pages
+        page_obj = self._page
+        for page in range(first_page(self.journal), pages + 1):
+            logger.info(f"Страница {page}/{pages}...")
+
+            url = self._search_url(query, page)
+            self._api_data.clear()
+
+            ok = False
+            for attempt in range(3):
+                try:
+                    await limiter.aacquire(url)
+                    await self._agoto_search(url)
+
+                    if "search" in page_obj.url or "catalog" in page_obj.url:
+                        ok = True
+                        break
+                    logger.warning(f"Редирект, попытка {attempt + 1}")
+                    await self._asleep(2)
+                except Exception as e:
+                    logger.warning(f"Ошибка загрузки: {e}")
+                    await self._asleep(2)
+
+            if not ok:
+                logger.warning(f"Страница {page} не загружена")
+                continue
+
+            if "search" not in self._api_data:
+                try:
+                    await page_obj.wait_for_selector("article.product-card", timeout=10000)
+                except Exception:
+                    pass
+
+                await page_obj.evaluate("window.scrollTo(0, document.body.scrollHeight / 2)")
+                await self._asleep(2)
+
+            products = []
+            if "search" in self._api_data:
+                items = self._api_data["search"].get("data", {}).get("products", [])
+                if not items:
+                    logger.info("Пусто, конец")
+                    yield page, []
+                    break
+                logger.info(f"API: {len(items)} товаров")
+                products = [self._product_from_api(item) for item in items]
+            else:
+                logger.info("API не перехвачен, парсим HTML")
+                cards = await page_obj.eval_on_selector_all("article.product-card", _HTML_CARDS_JS)
+                if not cards:
+                    logger.warning("И HTML пуст, пропускаем страницу")
+                    break
+                for d in cards:
+                    p = self._product_from_html_data(d)
+                    if p:
+                        products.append(p)
+                logger.info(f"HTML: {len(cards)} товаров")
+
+            yield page, products
+
+    async def aget_details(self, articles):
+        """Детали пачками, пачки - параллельно по пулу."""
+        result, batches = self._split_cached_details(articles)
+
+        async def one(batch):
+            try:
+                data = await self._aapi_get(self._detail_url(batch))
+            except Exception as e:
+                logger.debug(f"Detail error {batch[0]}..{batch[-1]}: {e}")
+                return
+            if data:
+                self._store_details(batch, data.get("data", {}).get("products", []), result)
+
+        await asyncio.gather(*(one(b) for b in batches))
+        return result
+
+    async def aget_card(self, article):
+        """Получаем карточку (описание, характеристики)."""
+        key = get_cache_key("card", article)
+        if self.use_cache:
+            cached = await asyncio.to_thread(get_cached, key)
+            if cached:
+                return cached
+
+        basket = baskets.for_article(article)
+        try:
+            data = await self._aapi_get(self._card_url(article, basket), missing=NOT_FOUND)
+            if data is NOT_FOUND:
+                # 404 - скорее всего не тот basket, ищем у соседей
+                data = None
+                found = await baskets.adiscover(article, basket, self._astatus)
+                if found is not None:
+                    data = await self._aapi_get(self._card_url(article, found))
+            data = prune_payload("card", data)
+            if data:
+                if self.use_cache:
+                    await asyncio.to_thread(set_cached, key, data, ttl=cache_ttl("card"))
+                return data
+        except Exception as e:
+            logger.debug(f"Card error {article}: {e}")
+        return {}
+
+    async def aenrich(self, product, detail=None):
+        """Дополняем продукт данными."""
+        if detail is None:
+            detail = (await self.aget_details([product.article])).get(product.article, {})
+        if detail:
+            self._apply_detail(product, detail)
+
+        card = await self.aget_card(product.article)
+        if card:
+            self._apply_card(product, card)
+        return product
+
+    async def _aenrich_safe(self, product, detail):
+        try:
+            await self.aenrich(product, detail)
+        except Exception as e:
+            logger.error(f"Ошибка {product.article}: {e}")
+        return product
+
+    async def aiter_parse(self, query, max_pages=None, enrich=True):
+        """Поиск и параллельное обогащение, товары отдаются по порядку."""
+        async for _, p in self.aiter_parse_batch([query], max_pages, enrich):
+            yield p
+
+    async def aiter_parse_batch(self, queries, max_pages=None, enrich=True):
+        """(запрос, товар) по всем запросам - браузер и пул страниц общие."""
+        await self._astart()
+        try:
+            for query in queries:
+                async for p in self._aiter_query(query, max_pages, enrich):
+                    yield query, p
+        finally:
+            await self._aclose()
+
+    async def _aiter_query(self, query, max_pages, enrich):
+        pending = deque()
+        count = 0
+
+        def counted(p):
+            # как take в WildberriesParser.iter_parse - лог раз в 20 товаров
+            nonlocal count
+            count += 1
+            if count % 20 == 0:
+                logger.info(f"Обогащено {count}")
+            return p
+
+        try:
+            async for page_products in self.aiter_search(query, max_pages):
+                if not enrich:
+                    for p in page_products:
+                        yield p
+                    continue
+
+                stale = stale_articles(page_products, self.articles, self.journal, self.delta)
+                details = await self.aget_details([p.article for p in page_products if p.article in stale])
+                for p in page_products:
+                    if p.article in stale:
+                        pending.append(asyncio.ensure_future(self._aenrich_safe(p, details.get(p.article, {}))))
+                    else:
+                        pending.append(asyncio.wrap_future(_resolved(p)))
+                    while len(pending) >= PIPELINE_BUFFER:
+                        yield counted(await pending.popleft())
+                while pending and pending[0].done():
+                    yield counted(pending.popleft().result())
+            while pending:
+                yield counted(await pending.popleft())
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def iter_parse(self, query, max_pages=None, enrich=True):
+        """Синхронный генератор для main."""
+        return iter_async(lambda: self.aiter_parse(query, max_pages, enrich))
+
+    def iter_parse_batch(self, queries, max_pages=None, enrich=True, parallel=True):
+        return iter_async(lambda: self.aiter_parse_batch(queries, max_pages, enrich))
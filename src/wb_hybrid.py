@@ -0,0 +1,112 @@
+"""Гибридный парсер: браузер только для сессии, весь трафик через httpx."""
+
+import logging
+import threading
+import time
+
+import httpx
+
+from src.config import HYBRID_REBOOTSTRAP_LIMIT, REQUEST_TIMEOUT, SEARCH_WINDOW, get_headers
+from src.wb_browser import WBBrowserParser
+from src.wb_parser import WildberriesParser
+
+logger = logging.getLogger(__name__)
+
+
+class HybridParser(WildberriesParser):
+    """Браузер открывает главную и проходит антибот, потом его куки и
+    user-agent уходят в httpx клиент, и поиск/детали/карточки идут уже
+    без Chromium. На 403/429 сессия переснимается в браузере заново -
+    с новым клиентом; старый закрывается в close(), его ещё могут
+    использовать другие потоки.
+
+    Детали (продавец, размеры, остатки) качаются пачками как в
+    WBBrowserParser, разбор ответов тоже оттуда.
+    """
+
+    def __init__(self, use_cache=True, max_workers=5, proxy=None,
+                 search_window=SEARCH_WINDOW, headless=True, delta=None, journal=None):
+        super().__init__(use_cache=use_cache, max_workers=max_workers, proxy=proxy,
+                         search_window=search_window, delta=delta, journal=journal)
+        self.headless = headless
+        # браузерный парсер не запускаем - нужны его хелперы разбора
+        self._helper = WBBrowserParser(use_cache=use_cache, headless=headless)
+        self._session = None
+        self._session_gen = 0
+        self._session_at = 0.0
+        self._session_lock = threading.Lock()
+        self._details = {}
+
+    def __enter__(self):
+        self._bootstrap()
+        return self
+
+    def _bootstrap(self):
+        # браузер поднимается в текущем потоке и сразу закрывается -
+        # sync Playwright нельзя дёргать из других потоков
+        logger.info("Гибрид: получаем сессию через браузер...")
+        with WBBrowserParser(use_cache=False, headless=self.headless) as browser:
+            session = browser.export_session()
+        self._session = session
+        self._session_gen += 1
+        self._session_at = time.monotonic()
+        self._refresh_client()
+        logger.info(f"Гибрид: сессия #{self._session_gen}, кук: {len(session['cookies'])}")
+
+    def _make_client(self):
+        headers = get_headers()
+        cookies = httpx.Cookies()
+        if self._session:
+            headers["User-Agent"] = self._session["user_agent"]
+            if self._session.get("accept_language"):
+                headers["Accept-Language"] = self._session["accept_language"]
+            for c in self._session["cookies"]:
+                cookies.set(c["name"], c["value"], domain=c.get("domain", ""), path=c.get("path", "/"))
+        return httpx.Client(
+            headers=headers,
+            cookies=cookies,
+            timeout=REQUEST_TIMEOUT,
+            follow_redirects=True,
+            proxy=self.proxy,
+        )
+
+    def _on_blocked(self, code):
+        gen = self._session_gen
+        with self._session_lock:
+            if gen != self._session_gen:
+                return True  # пока ждали лок, другой поток уже переснял
+            if time.monotonic() - self._session_at < HYBRID_REBOOTSTRAP_LIMIT:
+                # только что переснимали - дальше пусть разбирается лимитер
+                return super()._on_blocked(code)
+            logger.warning(f"HTTP {code}, пересоздаём сессию в браузере")
+            try:
+                self._bootstrap()
+            except Exception as e:
+                logger.error(f"Не удалось пересоздать сессию: {e}")
+                return False
+        return True
+
+    def get_details(self, articles):
+        """Детали пачками через httpx."""
+        h = self._helper
+        result, batches = h._split_cached_details(articles)
+        for batch in batches:
+            data = self._request(h._detail_url(batch))
+            if data:
+                h._store_details(batch, data.get("data", {}).get("products", []), result)
+        return result
+
+    def _prepare_page(self, page_products):
+        # детали всей страницы сразу пачкой, enrich потом берёт готовые
+        stale = super()._prepare_page(page_products)
+        self._details.update(self.get_details([p.article for p in page_products if p.article in stale]))
+        return stale
+
+    def enrich(self, product):
+        """Детали + карточка."""
+        detail = self._details.pop(product.article, None)
+        if detail is None:
+            detail = self.get_details([product.article]).get(product.article)
+        if detail:
+            self._helper._apply_detail(product, detail)
+        return super().enrich(product)
@@ -2,38 +2,64 @@
 
 import logging
 import random
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import httpx
 
-from src.cache import get_cache_key, get_cached, set_cached
+from src.basket import NOT_FOUND, baskets, card_url, image_urls
+from src.cache import cache_ttl, get_cache_entry, get_cache_key, set_cached, touch_cached
+from src.checkpoint import first_page, iter_journaled
 from src.config import (
-    DELAY_BETWEEN_PAGES,
-    DELAY_BETWEEN_PRODUCTS,
-    DELAY_ON_ERROR,
     MAX_PAGES,
+    PIPELINE_BUFFER,
     PRODUCT_URL,
     REQUEST_TIMEOUT,
     RETRY_COUNT,
     RETRY_DELAY,
     SEARCH_URL,
+    SEARCH_WINDOW,
     SELLER_URL,
     get_headers,
 )
-from src.models import Product
+from src.delta import stale_articles
+from src.metrics import metrics
+from src.models import Product, intern_str
+from src.payload import loads, prune_payload
+from src.rate_limit import limiter
 
 logger = logging.getLogger(__name__)
 
 
+def _resolved(value):
+    # готовый Future - для товаров, которые обогащать не надо
+    future = Future()
+    future.set_result(value)
+    return future
+
+
 class WildberriesParser:
     """HTTP парсер WB - работает без браузера, но может блокироваться."""
     
-    def __init__(self, use_cache=True, max_workers=5, proxy=None):
+    def __init__(self, use_cache=True, max_workers=5, proxy=None, search_window=SEARCH_WINDOW,
+                 delta=None, journal=None):
         self.use_cache = use_cache
         self.max_workers = max_workers
+        self.search_window = search_window
         self.proxy = proxy
+        # DeltaStore (src/delta.py) - обогащать только новое и изменившееся
+        self.delta = delta
+        # RunJournal (src/checkpoint.py) - страницы и товары для --resume
+        self.journal = journal
+        # ArticleMap (src/batch.py) - товары из прошлых запросов пакета
+        self.articles = None
         self._client = None
+        self._client_lock = threading.Lock()
+        # заменённые клиенты: ими могут ещё пользоваться другие потоки,
+        # закрываем в close()
+        self._retired = []
         self._req_count = 0
 
     def __enter__(self):
@@ -42,124 +68,127 @@ class WildberriesParser:
     def __exit__(self, *args):
         self.close()
 
-    def _get_client(self):
-        if self._client is None or self._client.is_closed:
-            self._client = httpx.Client(
-                headers=get_headers(),
-                timeout=REQUEST_TIMEOUT,
-                follow_redirects=True,
-                proxy=self.proxy,
-            )
-        return self._client
-
-    def _refresh_client(self):
-        if self._client and not self._client.is_closed:
-            self._client.close()
-        self._client = httpx.Client(
+    def _make_client(self):
+        return httpx.Client(
             headers=get_headers(),
             timeout=REQUEST_TIMEOUT,
             follow_redirects=True,
             proxy=self.proxy,
         )
 
-    def close(self):
-        if self._client and not self._client.is_closed:
-            self._client.close()
+    def _get_client(self):
+        client = self._client
+        if client is None or client.is_closed:
+            with self._client_lock:
+                if self._client is None or self._client.is_closed:
+                    self._client = self._make_client()
+                client = self._client
+        return client
+
+    def _refresh_client(self):
+        # новый клиент для следующих запросов; старый не закрываем -
+        # в нём могут быть запросы других потоков
+        client = self._make_client()
+        with self._client_lock:
+            if self._client is not None:
+                self._retired.append(self._client)
+            self._client = client
 
-    def _sleep(self, sec):
-        time.sleep(sec + random.uniform(-0.2, 0.3))
+    def _on_blocked(self, code):
+        """403/429 от API. True - повторяем запрос, False - сдаёмся."""
+        if code == 429:
+            # ждать будем в limiter.acquire - пауза общая на хост; клиент
+            # не пересоздаём - им сейчас пользуются другие потоки
+            logger.warning("429 Too Many Requests, хост на паузе")
+            return True
+        return False
 
-    def _request(self, url, params=None, cache_prefix=None):
-        """Запрос с ретраями и кэшем."""
+    def close(self):
+        with self._client_lock:
+            clients = self._retired + [self._client]
+            self._retired = []
+        for client in clients:
+            if client is not None and not client.is_closed:
+                client.close()
+
+    def _request(self, url, params=None, cache_prefix=None, stop=None, missing=None):
+        """Запрос с ретраями и кэшем. stop (threading.Event) выставлен -
+        новых попыток не делаем, возвращаем None. На 404 - missing
+        (по умолчанию тоже None)."""
         cache_key = None
+        entry = None
+        headers = {}
         if self.use_cache and cache_prefix:
             cache_key = get_cache_key(cache_prefix, url, str(sorted(params.items()) if params else ""))
-            cached = get_cached(cache_key)
-            if cached:
-                return cached
+            entry = get_cache_entry(cache_key)
+            if entry and entry.data and entry.fresh:
+                return entry.data
+            # протухло - спрашиваем сервер, изменилось ли
+            if entry and entry.data:
+                if entry.etag:
+                    headers["If-None-Match"] = entry.etag
+                if entry.last_modified:
+                    headers["If-Modified-Since"] = entry.last_modified
         
         last_err = None
         for attempt in range(RETRY_COUNT):
+            if stop is not None and stop.is_set():
+                return None
             try:
+                limiter.acquire(url)
                 self._req_count += 1
                 client = self._get_client()
-                resp = client.get(url, params=params)
+                started = time.perf_counter()
+                try:
+                    resp = client.get(url, params=params, headers=headers)
+                except httpx.RequestError:
+                    metrics.request(url, "error", time.perf_counter() - started, attempt)
+                    raise
+                metrics.request(url, resp.status_code, time.perf_counter() - started, attempt)
+                limiter.feedback(url, resp.status_code, resp.headers.get("Retry-After"))
+                if resp.status_code == 304 and entry:
+                    # не изменилось - тело не качаем и не парсим
+                    touch_cached(cache_key, cache_ttl(cache_prefix))
+                    return entry.data
                 resp.raise_for_status()
-                data = resp.json()
+                # в кэш и дальше - только нужные парсеру поля
+                data = prune_payload(cache_prefix, loads(resp.content))
                 
                 if cache_key and data:
-                    set_cached(cache_key, data)
+                    set_cached(
+                        cache_key, data,
+                        ttl=cache_ttl(cache_prefix),
+                        etag=resp.headers.get("ETag"),
+                        last_modified=resp.headers.get("Last-Modified"),
+                    )
                 return data
                 
             except httpx.HTTPStatusError as e:
                 last_err = e
                 code = e.response.status_code
                 
-                if code == 429:
-                    wait = DELAY_ON_ERROR * (attempt + 1) * 2
-                    logger.warning(f"429 Too Many Requests, ждём {wait}с...")
-                    self._refresh_client()
-                    time.sleep(wait)
+                if code in (403, 429) and self._on_blocked(code):
+                    pass  # повторяем
                 elif code == 404:
-                    return None
+                    return missing
                 elif code >= 500:
-                    time.sleep(RETRY_DELAY * (attempt + 1))
+                    metrics.sleep(RETRY_DELAY * (attempt + 1), "retry")
                 else:
                     logger.error(f"HTTP {code}: {url[:50]}...")
                     return None
                     
             except httpx.TimeoutException:
                 last_err = "timeout"
-                time.sleep(RETRY_DELAY * (attempt + 1))
+                metrics.sleep(RETRY_DELAY * (attempt + 1), "retry")
             except httpx.RequestError as e:
                 last_err = e
-                time.sleep(RETRY_DELAY * (attempt + 1))
+                metrics.sleep(RETRY_DELAY * (attempt + 1), "retry")
         
         logger.error(f"Все попытки провалились: {last_err}")
         return None
 
-    def _get_basket(self, vol):
-        # определяем номер basket по vol (скопировал из другого парсера)
-        if vol <= 143:
-            return "01"
-        elif vol <= 287:
-            return "02"
-        elif vol <= 431:
-            return "03"
-        elif vol <= 719:
-            return "04"
-        elif vol <= 1007:
-            return "05"
-        elif vol <= 1061:
-            return "06"
-        elif vol <= 1115:
-            return "07"
-        elif vol <= 1169:
-            return "08"
-        elif vol <= 1313:
-            return "09"
-        elif vol <= 1601:
-            return "10"
-        elif vol <= 1655:
-            return "11"
-        elif vol <= 1919:
-            return "12"
-        elif vol <= 2045:
-            return "13"
-        elif vol <= 2189:
-            return "14"
-        elif vol <= 2405:
-            return "15"
-        elif vol <= 2621:
-            return "16"
-        return "17"  # по умолчанию
-
-    def _get_images(self, article, count=10):
-        vol = article // 100000
-        part = article // 1000
-        basket = self._get_basket(vol)
-        base = f"https://basket-{basket}.wbbasket.ru/vol{vol}/part{part}/{article}/images/big"
-        return [f"{base}/{i}.webp" for i in range(1, count + 1)]
+    def _get_images(self, article, count=None):
+        return image_urls(article, count)
 
     def _parse_sizes(self, sizes_data):
         # парсим размеры и считаем остатки
@@ -193,7 +222,7 @@ class WildberriesParser:
             article=article,
             name=item.get("name", ""),
             price=price,
-            images=self._get_images(article),
+            images=self._get_images(article, item.get("pics")),
             seller_name=item.get("supplier", ""),
             seller_url=SELLER_URL.format(seller_id=seller_id) if seller_id else "",
             sizes=sizes,
@@ -203,118 +232,213 @@ class WildberriesParser:
             brand=item.get("brand", ""),
         )
 
-    def search(self, query, max_pages=None):
-        """Поиск товаров."""
+    def _search_params(self, query, page):
+        return {
+            "ab_testing": "false",
+            "appType": "1",
+            "curr": "rub",
+            "dest": "-1257786",
+            "page": page,
+            "query": query,
+            "resultset": "catalog",
+            "sort": "popular",
+            "spp": "30",
+        }
+
+    def _search_page(self, query, page, stop=None):
+        # None - страница не загрузилась (или stop), [] - пусто
+        params = self._search_params(query, page)
+        data = self._request(SEARCH_URL, params, cache_prefix=f"search_{query}", stop=stop)
+        if not data:
+            return None
+        return data.get("data", {}).get("products", [])
+
+    def iter_search(self, query, max_pages=None):
+        """Поиск товаров - отдаём товары постранично, по мере загрузки.
+
+        Одновременно грузится до search_window страниц, отдаются строго
+        по порядку. Как только страница пустая - остальные отменяем:
+        неначатые не запускаются, начатые не делают новых попыток (и не
+        тратят лимит), но запрос, уже ушедший на сервер, дожидается ответа.
+        С журналом (src/checkpoint.py) записанные страницы не грузятся.
+        """
         pages = max_pages or MAX_PAGES
-        products = []
+        yield from iter_journaled(self.journal, self._iter_pages(query, pages), pages)
+
+    def _iter_pages(self, query, pages):
+        # (номер, товары) с первой незаписанной страницы, [] - выдача кончилась
+        window = max(1, self.search_window)
         
         # небольшая задержка перед началом (чтобы не палиться)
         delay = random.uniform(1.0, 2.0)
-        time.sleep(delay)
-        
-        for page in range(1, pages + 1):
-            logger.info(f"Страница {page}/{pages}...")
-            
-            params = {
-                "ab_testing": "false",
-                "appType": "1",
-                "curr": "rub",
-                "dest": "-1257786",
-                "page": page,
-                "query": query,
-                "resultset": "catalog",
-                "sort": "popular",
-                "spp": "30",
-            }
-            
-            data = self._request(SEARCH_URL, params, cache_prefix=f"search_{query}")
-            if not data:
-                logger.warning(f"Страница {page} не загружена")
-                break
-            
-            items = data.get("data", {}).get("products", [])
-            if not items:
-                logger.info("Пусто, конец")
-                break
-            
-            logger.info(f"Найдено: {len(items)}")
-            for item in items:
-                products.append(self._product_from_item(item))
-            
-            if page < pages:
-                self._sleep(DELAY_BETWEEN_PAGES)
+        metrics.sleep(delay, "jitter")
         
+        executor = ThreadPoolExecutor(max_workers=window)
+        stop = threading.Event()
+        pending = deque()
+        next_page = first_page(self.journal)
+        try:
+            while True:
+                while next_page <= pages and len(pending) < window:
+                    future = executor.submit(self._search_page, query, next_page, stop)
+                    pending.append((next_page, future))
+                    next_page += 1
+                if not pending:
+                    break
+                
+                page, future = pending.popleft()
+                items = future.result()
+                if items is None:
+                    logger.warning(f"Страница {page} не загружена")
+                    break
+                if not items:
+                    logger.info("Пусто, конец")
+                    yield page, []
+                    break
+                
+                logger.info(f"Страница {page}/{pages}: {len(items)}")
+                yield page, [self._product_from_item(item) for item in items]
+        finally:
+            # что ещё не началось - отменяется, что идёт - бросит на
+            # следующей попытке; не ждём
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def search(self, query, max_pages=None):
+        """Поиск товаров."""
+        products = []
+        for page_products in self.iter_search(query, max_pages):
+            products.extend(page_products)
         return products
 
+    def _card_url(self, article, basket=None):
+        return card_url(article, basket)
+
+    def _status(self, url):
+        # проба хоста basket - нужен только код ответа, тело не качаем
+        limiter.acquire(url)
+        started = time.perf_counter()
+        try:
+            resp = self._get_client().head(url)
+        except httpx.RequestError:
+            metrics.request(url, "error", time.perf_counter() - started)
+            return 0
+        metrics.request(url, resp.status_code, time.perf_counter() - started)
+        limiter.feedback(url, resp.status_code, resp.headers.get("Retry-After"))
+        return resp.status_code
+
     def get_card(self, article):
         """Карточка товара."""
-        vol = article // 100000
-        part = article // 1000
-        basket = self._get_basket(vol)
-        url = f"https://basket-{basket}.wbbasket.ru/vol{vol}/part{part}/{article}/info/ru/card.json"
-        return self._request(url, cache_prefix=f"card_{article}") or {}
+        basket = baskets.for_article(article)
+        card = self._request(self._card_url(article, basket), cache_prefix=f"card_{article}", missing=NOT_FOUND)
+        if card is NOT_FOUND:
+            # 404 - скорее всего не тот basket, ищем у соседей
+            card = None
+            found = baskets.discover(article, basket, self._status)
+            if found is not None:
+                card = self._request(self._card_url(article, found), cache_prefix=f"card_{article}")
+        return card or {}
+
+    def _apply_card(self, product, card):
+        # описание и характеристики из card.json
+        product.description = card.get("description", "")
+        
+        for opt in card.get("options", []):
+            name = opt.get("name", "")
+            value = opt.get("value", "")
+            if name and value:
+                product.characteristics[intern_str(name)] = value
+                if "страна" in name.lower():
+                    product.country = intern_str(value)
+        
+        photos = card.get("media", {}).get("photo_count")
+        if photos:
+            product.images = self._get_images(product.article, photos)
+        
+        comps = card.get("compositions", [])
+        if comps:
+            comp_str = "; ".join(f"{c['name']}: {c['value']}" for c in comps if c.get("name"))
+            if comp_str:
+                product.characteristics["Состав"] = comp_str
 
     def enrich(self, product):
         """Обогащаем данные."""
         card = self.get_card(product.article)
         if card:
-            product.description = card.get("description", "")
-            
-            for opt in card.get("options", []):
-                name = opt.get("name", "")
-                value = opt.get("value", "")
-                if name and value:
-                    product.characteristics[name] = value
-                    if "страна" in name.lower():
-                        product.country = value
-            
-            comps = card.get("compositions", [])
-            if comps:
-                comp_str = "; ".join(f"{c['name']}: {c['value']}" for c in comps if c.get("name"))
-                if comp_str:
-                    product.characteristics["Состав"] = comp_str
-        
+            self._apply_card(product, card)
         return product
 
-    def _enrich_worker(self, product):
-        self._sleep(DELAY_BETWEEN_PRODUCTS)
-        return self.enrich(product)
+    def _prepare_page(self, page_products):
+        """Перед обогащением страницы - какие артикулы обогащать."""
+        return stale_articles(page_products, self.articles, self.journal, self.delta)
 
-    def parse_all(self, query, max_pages=None, enrich=True, parallel=True):
-        """Полный парсинг."""
-        products = self.search(query, max_pages)
-        logger.info(f"Найдено: {len(products)}")
+    def iter_parse(self, query, max_pages=None, enrich=True, parallel=True):
+        """Поиск и обогащение конвейером.
+
+        Товары страницы уходят в пул сразу, пока грузится следующая
+        страница. Отдаём в исходном порядке; в работе не больше
+        PIPELINE_BUFFER товаров - если потребитель не успевает,
+        поиск тоже ждёт.
+        """
+        pages = self.iter_search(query, max_pages)
         
-        if not enrich or not products:
-            return products
+        if not enrich:
+            for page_products in pages:
+                yield from page_products
+            return
         
-        logger.info("Обогащение...")
+        if not parallel or self.max_workers <= 1:
+            count = 0
+            for page_products in pages:
+                stale = self._prepare_page(page_products)
+                for p in page_products:
+                    yield self.enrich(p) if p.article in stale else p
+                    count += 1
+                    if count % 20 == 0:
+                        logger.info(f"Обогащено {count}")
+            return
         
-        if parallel and self.max_workers > 1:
-            enriched = []
-            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                futures = {executor.submit(self._enrich_worker, p): i for i, p in enumerate(products)}
-                
-                for i, future in enumerate(as_completed(futures), 1):
-                    try:
-                        p = future.result()
-                        enriched.append((futures[future], p))
-                    except Exception as e:
-                        idx = futures[future]
-                        logger.error(f"Ошибка {idx}: {e}")
-                        enriched.append((idx, products[idx]))
-                    
-                    if i % 20 == 0:
-                        logger.info(f"Обогащено {i}/{len(products)}")
-            
-            enriched.sort(key=lambda x: x[0])
-            products = [p for _, p in enriched]
-        else:
-            for i, p in enumerate(products, 1):
-                self.enrich(p)
-                self._sleep(DELAY_BETWEEN_PRODUCTS)
-                if i % 20 == 0:
-                    logger.info(f"Обогащено {i}/{len(products)}")
+        count = 0
+        pending = deque()
+        
+        def take():
+            nonlocal count
+            p, future = pending.popleft()
+            try:
+                p = future.result()
+            except Exception as e:
+                logger.error(f"Ошибка {p.article}: {e}")
+            count += 1
+            if count % 20 == 0:
+                logger.info(f"Обогащено {count}")
+            return p
         
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                for page_products in pages:
+                    stale = self._prepare_page(page_products)
+                    for p in page_products:
+                        future = executor.submit(self.enrich, p) if p.article in stale else _resolved(p)
+                        pending.append((p, future))
+                        while len(pending) >= PIPELINE_BUFFER:
+                            yield take()
+                    # всё что уже готово - отдаём сразу
+                    while pending and pending[0][1].done():
+                        yield take()
+                while pending:
+                    yield take()
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+    def iter_parse_batch(self, queries, max_pages=None, enrich=True, parallel=True):
+        """(запрос, товар) по всем запросам подряд на одном клиенте."""
+        for query in queries:
+            for p in self.iter_parse(query, max_pages, enrich, parallel):
+                yield query, p
+
+    def parse_all(self, query, max_pages=None, enrich=True, parallel=True):
+        """Полный парсинг."""
+        products = list(self.iter_parse(query, max_pages, enrich, parallel))
         logger.info(f"Готово: {len(products)}")
         return products
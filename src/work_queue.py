@@ -0,0 +1,299 @@
+"""Очередь обогащения для нескольких процессов и контейнеров.
+
+Координатор (python -m src.main --queue FILE) только ищет и кладёт товары
+в очередь, обогащают воркеры (python -m src.worker FILE) - сколько угодно,
+каждый со своим парсером и прокси. Очередь - один файл SQLite (WAL) на
+общем томе:
+
+    jobs   артикул -> товар из поиска, состояние, аренда, попытки, результат
+    items  запрос -> артикулы по порядку выдачи (для выгрузки)
+
+Воркер берёт пачку в аренду на QUEUE_VISIBILITY сек. Не успел (упал,
+завис) - аренда истекает и пачку берёт другой. После QUEUE_MAX_ATTEMPTS
+попыток товар помечается failed и выгружается без обогащения. Артикул
+в очереди один на все запросы - общие товары обогащаются один раз.
+Файл очереди можно переиспользовать: новый запуск запроса заново
+собирает его items, а товары, обогащённые в прошлых запусках, снова
+идут в работу со свежими ценой и остатками из поиска.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from src.checkpoint import product_from_dict, product_to_dict
+from src.config import QUEUE_MAX_ATTEMPTS, QUEUE_POLL, QUEUE_STALL_TIMEOUT, QUEUE_VISIBILITY
+from src.sinks import export_all
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+class WorkQueue:
+    """Очередь артикулов в SQLite. Соединение своё на поток и процесс."""
+
+    def __init__(self, path, visibility=QUEUE_VISIBILITY, max_attempts=QUEUE_MAX_ATTEMPTS):
+        self.path = Path(path)
+        self.visibility = visibility
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " article INTEGER PRIMARY KEY,"
+            " payload TEXT NOT NULL,"
+            " state TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " lease_until REAL NOT NULL DEFAULT 0,"
+            " worker TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " error TEXT,"
+            " result TEXT)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            " query TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " article INTEGER NOT NULL,"
+            " PRIMARY KEY (query, article))"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _write(self, fn):
+        # BEGIN IMMEDIATE - аренду не возьмут два процесса сразу
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def _expire(self, conn, now):
+        # истёкшие аренды (воркер упал или завис): обратно в pending,
+        # а кто исчерпал попытки - в failed
+        conn.execute(
+            "UPDATE jobs SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END,"
+            " lease_until = 0, error = CASE WHEN attempts >= ? THEN COALESCE(error, 'lease expired')"
+            " ELSE error END WHERE state = ? AND lease_until < ?",
+            (self.max_attempts, FAILED, PENDING, self.max_attempts, LEASED, now),
+        )
+
+    # --- координатор ---
+
+    def begin(self, query):
+        """Новый запуск запроса: выдача прошлых запусков не нужна, как и
+        флаги поиска, брошенные упавшими координаторами. Возвращает время
+        начала - его ждёт publish."""
+        now = time.time()
+
+        def run(conn):
+            conn.execute("DELETE FROM items WHERE query = ?", (query,))
+            conn.execute(
+                "DELETE FROM meta WHERE key LIKE 'searching:%' AND CAST(value AS REAL) < ?",
+                (now - self.visibility,),
+            )
+
+        self._write(run)
+        return now
+
+    def publish(self, query, products, since):
+        """Товары страницы поиска. Артикул, уже поставленный в этом запуске
+        (since - из begin), повторно не обогащается, только попадает в
+        выгрузку запроса. Оставшийся от прошлых запусков - обогащается
+        заново: цена и остатки в старом результате устарели."""
+        now = time.time()
+
+        def run(conn):
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM items WHERE query = ?", (query,)).fetchone()[0]
+            conn.executemany(
+                "INSERT INTO jobs (article, payload, state, created) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (article) DO UPDATE SET payload = excluded.payload,"
+                " state = excluded.state, created = excluded.created, lease_until = 0,"
+                " worker = NULL, attempts = 0, error = NULL, result = NULL"
+                " WHERE jobs.created < ? AND NOT (jobs.state = ? AND jobs.lease_until >= ?)",
+                [(p.article, json.dumps(product_to_dict(p), ensure_ascii=False), PENDING, now, since, LEASED, now)
+                 for p in products],
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO items (query, seq, article) VALUES (?, ?, ?)",
+                [(query, seq + i, p.article) for i, p in enumerate(products, 1)],
+            )
+            # заодно отмечаемся: координатор жив
+            conn.execute("UPDATE meta SET value = ? WHERE key = ?", (str(now), f"searching:{query}"))
+
+        self._write(run)
+
+    def set_searching(self, query, active):
+        """Пока поиск идёт, воркеры не выходят на пустой очереди. В value -
+        время последней страницы: флаг упавшего координатора протухает
+        через visibility сек."""
+        def run(conn):
+            if active:
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                             (f"searching:{query}", str(time.time())))
+            else:
+                conn.execute("DELETE FROM meta WHERE key = ?", (f"searching:{query}",))
+
+        self._write(run)
+
+    def searching(self):
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM meta WHERE key LIKE 'searching:%' AND CAST(value AS REAL) >= ?",
+            (time.time() - self.visibility,),
+        ).fetchone()[0] > 0
+
+    def active(self):
+        """Воркеру есть чего ждать: идёт поиск или чьи-то товары в работе
+        (упадёт воркер - аренда истечёт, и их надо будет доделать)."""
+        if self.searching():
+            return True
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)", (PENDING, LEASED)
+        ).fetchone()[0] > 0
+
+    def counts(self, query=None):
+        """{состояние: число} - по всей очереди или по запросу."""
+        if query is None:
+            rows = self._conn().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state")
+        else:
+            rows = self._conn().execute(
+                "SELECT j.state, COUNT(*) FROM items i JOIN jobs j ON j.article = i.article"
+                " WHERE i.query = ? GROUP BY j.state", (query,)
+            )
+        return dict(rows.fetchall())
+
+    def wait(self, query, poll=QUEUE_POLL, log_every=30, stall=QUEUE_STALL_TIMEOUT):
+        """Ждём, пока воркеры обогатят все товары запроса. Если за stall
+        сек ни один товар не обогатился (воркеров нет) - больше не ждём,
+        недоделанное выгрузится как из поиска."""
+        logged = 0.0
+        progress = None
+        moved = time.monotonic()
+        while True:
+            self._write(lambda conn: self._expire(conn, time.time()))
+            counts = self.counts(query)
+            left = counts.get(PENDING, 0) + counts.get(LEASED, 0)
+            if not left:
+                return counts
+            finished = counts.get(DONE, 0) + counts.get(FAILED, 0)
+            if finished != progress:
+                progress = finished
+                moved = time.monotonic()
+            elif stall and time.monotonic() - moved >= stall:
+                logger.warning(f"Очередь: {stall:.0f} сек без прогресса, осталось {left} - "
+                               f"выгружаем без обогащения")
+                return counts
+            if time.monotonic() - logged >= log_every:
+                logger.info(f"Очередь: осталось {left}, готово {counts.get(DONE, 0)}, "
+                            f"ошибок {counts.get(FAILED, 0)}")
+                logged = time.monotonic()
+            time.sleep(poll)
+
+    def results(self, query):
+        """Товары запроса в порядке выдачи; необогащённые - как из поиска."""
+        rows = self._conn().execute(
+            "SELECT j.result, j.payload FROM items i JOIN jobs j ON j.article = i.article"
+            " WHERE i.query = ? ORDER BY i.seq", (query,)
+        )
+        for result, payload in rows:
+            yield product_from_dict(json.loads(result or payload))
+
+    # --- воркер ---
+
+    def lease(self, worker, limit):
+        """Берём до limit товаров в аренду: новые и те, чья аренда истекла."""
+        now = time.time()
+
+        def run(conn):
+            self._expire(conn, now)
+            rows = conn.execute(
+                "SELECT article, payload FROM jobs WHERE state = ? ORDER BY created LIMIT ?",
+                (PENDING, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET state = ?, lease_until = ?, worker = ?, attempts = attempts + 1"
+                " WHERE article = ?",
+                [(LEASED, now + self.visibility, worker, article) for article, _ in rows],
+            )
+            return rows
+
+        return [product_from_dict(json.loads(payload)) for _, payload in self._write(run)]
+
+    def complete(self, product, worker):
+        """Результат воркера. Принимаем, только пока аренда за ним: иначе
+        товар уже у другого или заново поставлен со свежими ценами."""
+        data = json.dumps(product_to_dict(product), ensure_ascii=False)
+        updated = self._write(lambda conn: conn.execute(
+            "UPDATE jobs SET state = ?, result = ?, error = NULL"
+            " WHERE article = ? AND state = ? AND worker = ?",
+            (DONE, data, product.article, LEASED, worker),
+        ).rowcount)
+        if not updated:
+            logger.debug(f"Очередь: поздний результат {product.article} от {worker} отброшен")
+
+    def fail(self, product, error, worker):
+        """Ошибка обогащения: обратно в очередь или failed после max_attempts.
+        Если аренда истекла и товар уже у другого воркера - не трогаем."""
+        def run(conn):
+            conn.execute(
+                "UPDATE jobs SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END,"
+                " lease_until = 0, error = ? WHERE article = ? AND state = ? AND worker = ?",
+                (self.max_attempts, FAILED, PENDING, str(error)[:500], product.article, LEASED, worker),
+            )
+
+        self._write(run)
+
+    def retry_failed(self):
+        """failed -> pending с нулём попыток (например, после смены прокси)."""
+        return self._write(lambda conn: conn.execute(
+            "UPDATE jobs SET state = ?, attempts = 0, error = NULL WHERE state = ?", (PENDING, FAILED),
+        ).rowcount)
+
+
+def run_queue(parser, queue, query, max_pages, formats, full_base, filtered_base, filter_func, track=None):
+    """Координатор: поиск -> очередь, ждём воркеров, выгружаем по порядку.
+
+    track - обёртка над потоком готовых товаров (например загрузка фото).
+    """
+    since = queue.begin(query)
+    queue.set_searching(query, True)
+    published = 0
+    try:
+        for page_products in parser.iter_search(query, max_pages):
+            queue.publish(query, page_products, since)
+            published += len(page_products)
+    finally:
+        queue.set_searching(query, False)
+    logger.info(f"В очереди {published} товаров, ждём воркеров (python -m src.worker {queue.path})")
+
+    counts = queue.wait(query)
+    if counts.get(FAILED):
+        logger.warning(f"Не обогащено после {queue.max_attempts} попыток: {counts[FAILED]}")
+    products = queue.results(query)
+    if track is not None:
+        products = track(products)
+    total, passed, _ = export_all(products, formats, full_base, filtered_base, filter_func)
+    return total, passed
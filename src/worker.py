@@ -0,0 +1,138 @@
+"""Воркер очереди обогащения (src/work_queue.py).
+
+    python -m src.worker .cache/queue.sqlite3 --proxy http://... -w 5
+    python -m src.worker .cache/queue.sqlite3 --browser
+
+Берёт товары пачками в аренду, обогащает своим парсером и возвращает
+результат. Воркеров можно запускать сколько угодно - в соседних
+процессах или контейнерах с общим томом. Выходит, когда координатор
+закончил поиск и в очереди нет ни новых товаров, ни взятых в аренду
+другими (упавший воркер их не доделает), или ждёт новых с --forever.
+"""
+
+import argparse
+import logging
+import os
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.cache import BACKENDS, set_backend
+from src.config import CACHE_BACKEND, QUEUE_LEASE_BATCH, QUEUE_POLL
+from src.main import setup_logging
+from src.wb_browser import WBBrowserParser
+from src.work_queue import WorkQueue
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Воркер обогащения WB")
+
+    parser.add_argument("queue", help="Файл очереди (как в --queue у src.main)")
+    parser.add_argument("-w", "--workers", type=int, default=5,
+                        help="Потоки (для HTTP режима)")
+    parser.add_argument("--batch", type=int, default=QUEUE_LEASE_BATCH,
+                        help="Товаров за одну аренду")
+    parser.add_argument("--browser", action="store_true", help="Режим браузера (Playwright)")
+    parser.add_argument("--hybrid", action="store_true",
+                        help="Браузер только для сессии, запросы через httpx")
+    parser.add_argument("--show-browser", action="store_true")
+    parser.add_argument("--proxy", help="Прокси (http://...)")
+    parser.add_argument("--no-cache", action="store_true", help="Без кэша")
+    parser.add_argument("--cache-backend", choices=sorted(BACKENDS), default=CACHE_BACKEND)
+    parser.add_argument("--forever", action="store_true",
+                        help="Не выходить на пустой очереди")
+    parser.add_argument("--id", help="Имя воркера (по умолчанию host:pid)")
+
+    parser.add_argument("-v", "--verbose", action="store_true")
+    return parser.parse_args()
+
+
+def make_parser(args):
+    if args.browser:
+        return WBBrowserParser(use_cache=not args.no_cache, headless=not args.show_browser)
+    if args.hybrid:
+        from src.wb_hybrid import HybridParser
+        return HybridParser(use_cache=not args.no_cache, max_workers=args.workers,
+                            proxy=args.proxy, headless=not args.show_browser)
+    from src.wb_parser import WildberriesParser
+    return WildberriesParser(use_cache=not args.no_cache, max_workers=args.workers, proxy=args.proxy)
+
+
+def enrich_batch(parser, products, executor=None):
+    """Обогащаем пачку; {артикул: ошибка} для тех, что не вышли.
+    Пустая карточка - тоже ошибка, пусть попробует ещё раз."""
+    errors = {}
+
+    def one(p, *extra):
+        try:
+            parser.enrich(p, *extra)
+        except Exception as e:
+            errors[p.article] = e
+            return
+        if not (p.description or p.characteristics):
+            errors[p.article] = "пустая карточка"
+
+    if isinstance(parser, WBBrowserParser):
+        # браузер: детали всей пачки одним запросом, дальше по одной карточке
+        details = parser.get_details([p.article for p in products])
+        for p in products:
+            one(p, details.get(p.article, {}))
+        return errors
+
+    # как страница в iter_parse: гибрид здесь берёт детали пачкой
+    parser._prepare_page(products)
+    if executor is not None:
+        list(executor.map(one, products))
+    else:
+        for p in products:
+            one(p)
+    return errors
+
+
+def main():
+    args = parse_args()
+    setup_logging(args.verbose)
+    logger = logging.getLogger(__name__)
+
+    set_backend(args.cache_backend)
+    queue = WorkQueue(args.queue)
+    name = args.id or f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"Воркер {name}, очередь {args.queue}")
+
+    done = failed = 0
+    try:
+        with make_parser(args) as parser:
+            executor = ThreadPoolExecutor(max_workers=args.workers) if args.workers > 1 and not args.browser else None
+            try:
+                while True:
+                    products = queue.lease(name, args.batch)
+                    if not products:
+                        if not args.forever and not queue.active():
+                            break
+                        time.sleep(QUEUE_POLL)
+                        continue
+
+                    errors = enrich_batch(parser, products, executor)
+                    for p in products:
+                        if p.article in errors:
+                            queue.fail(p, errors[p.article], name)
+                            failed += 1
+                        else:
+                            queue.complete(p, name)
+                            done += 1
+                    logger.info(f"Обогащено {done}, ошибок {failed}")
+            finally:
+                if executor is not None:
+                    executor.shutdown(cancel_futures=True)
+    except KeyboardInterrupt:
+        # взятое в аренду вернётся в очередь по истечении аренды
+        logger.info("Прервано (Ctrl+C)")
+        return 130
+
+    logger.info(f"Очередь пуста. Обогащено {done}, ошибок {failed}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())